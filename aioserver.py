@@ -0,0 +1,135 @@
+"""
+asyncio variant of the packet processing server, selected with
+server.py --asyncio. One event loop owns the MQTT socket through
+paho's external loop callbacks and runs the state machine timeouts
+and the polling schedule as loop timers. Database writes are handed
+to one worker thread, so a slow commit does not hold up the bus.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from logging import getLogger
+from server import Server, MISC_INTERVAL, DISPLAY_INTERVAL
+
+logger = getLogger(__name__)
+
+
+class AsyncServer(Server):
+
+    def __init__(self, *args, **kwargs):
+        self.loop = asyncio.new_event_loop()
+        self.scheduled = False
+        self.timer = None
+        self.writing = False
+        self.executor = None
+        super().__init__(*args, **kwargs)
+        if self.db is not None:
+            # one thread, DB keeps a session per thread and the rows
+            # have to be written in order
+            self.executor = ThreadPoolExecutor(1, thread_name_prefix='db')
+
+    def connect_mqtt(self):
+        client = super().connect_mqtt()
+        # no socket_register_write callback, paho then sends a publish
+        # right away like in the threaded server and flush() waits for
+        # the socket only when its buffer is full
+        client.on_socket_open = self.on_socket_open
+        client.on_socket_close = self.on_socket_close
+        # connect() opened the socket before the callbacks were set
+        self.on_socket_open(client, None, client.socket())
+        return client
+
+    def on_socket_open(self, _client, _userdata, sock):
+        self.loop.add_reader(sock, self.on_readable)
+
+    def on_socket_close(self, _client, _userdata, sock):
+        self.loop.remove_reader(sock)
+        if self.writing:
+            self.loop.remove_writer(sock)
+            self.writing = False
+
+    def flush(self):
+        client = self.client
+        if client.want_write():
+            client.loop_write()
+        sock = client.socket()
+        if sock is None:
+            return
+        if client.want_write():
+            if not self.writing:
+                self.loop.add_writer(sock, self.flush)
+                self.writing = True
+        elif self.writing:
+            self.loop.remove_writer(sock)
+            self.writing = False
+
+    def on_readable(self):
+        client = self.client
+        client.loop_read()
+        sock = client.socket()
+        pending = getattr(sock, 'pending', None)
+        if pending is not None and pending() > 0:
+            # TLS data already decrypted and buffered by ssl
+            self.loop.call_soon(self.on_readable)
+        self.process()
+
+    def wakeup(self):
+        if not self.scheduled:
+            self.scheduled = True
+            self.loop.call_soon_threadsafe(self.process)
+
+    def write_db(self, kind, func, *args):
+        self.executor.submit(self._write_db, kind, func, *args)
+
+    def _write_db(self, kind, func, *args):
+        try:
+            super().write_db(kind, func, *args)
+        except Exception as e:
+            logger.error('%s write failed: %s', kind, e)
+
+    def process(self):
+        """One pass of the work of Server.run() without the wait."""
+        self.scheduled = False
+        self.publish_state()
+        for ac in self.units.values():
+            ac.loop()
+        if self.metrics_interval:
+            self.publish_metrics()
+        if self.profiler is not None:
+            self.profiler.dump(self.client, f'{self.topic}/profile')
+        if self.snapshot:
+            self.save_snapshot()
+        if self.disp:
+            if self.disp.loop(self.ac):
+                self.loop.stop()
+                return
+        self.flush()
+        self.schedule_timer()
+
+    def schedule_timer(self):
+        timeout = None
+        for ac in self.units.values():
+            t = ac.next_timeout()
+            if t is not None and (timeout is None or t < timeout):
+                timeout = t
+        if self.disp and (timeout is None or timeout > DISPLAY_INTERVAL):
+            timeout = DISPLAY_INTERVAL
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if timeout is not None:
+            self.timer = self.loop.call_later(timeout, self.process)
+
+    def misc(self):
+        # paho keepalive, independent of the timer process() moves
+        self.client.loop_misc()
+        self.process()
+        self.loop.call_later(MISC_INTERVAL, self.misc)
+
+    def run(self):
+        self.loop.call_soon(self.misc)
+        try:
+            self.loop.run_forever()
+        finally:
+            if self.executor is not None:
+                self.executor.shutdown(wait=True)
+            self.loop.close()
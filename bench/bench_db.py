@@ -0,0 +1,69 @@
+"""
+Packet log inserts per second at each durability level of the SQLite
+database, one commit per row as with server.py -p and in batches as
+with -p -b. fsync costs depend on the storage, run it with --dir on
+the disk that holds packetlog.
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+# pylint: disable=wrong-import-position
+from database import DB  # noqa: E402
+
+LEVELS = (
+    ('DELETE', 'FULL'),  # SQLite defaults
+    ('WAL', 'FULL'),
+    ('WAL', 'NORMAL'),
+    ('WAL', 'OFF'),
+)
+PACKET = bytes.fromhex('00fe580a808129400000727600002b')
+
+
+def run(path, journal_mode, synchronous, rows, buffered):
+    url = f'sqlite:///{path}'
+    db = DB(
+        url, buffered=buffered, journal_mode=journal_mode,
+        synchronous=synchronous, queue_size=rows + 1
+    )
+    t0 = time.perf_counter()
+    for _ in range(rows):
+        db.write_packet('RX', PACKET)
+    db.close()  # waits for the buffered writer
+    elapsed = time.perf_counter() - t0
+    dropped = db.dropped
+    os.remove(path)
+    return rows / elapsed, dropped
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', type=int, default=500,
+                        help='rows per run with one commit per row')
+    parser.add_argument('--dir', help='directory for the test database')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(dir=args.dir)
+    path = os.path.join(workdir, 'log.sqlite3')
+    try:
+        print(f'{"journal":8s} {"synchronous":12s}'
+              f' {"per row":>12s} {"batched":>12s}  rows/s')
+        for journal_mode, synchronous in LEVELS:
+            single, _ = run(path, journal_mode, synchronous, args.n, False)
+            batched, dropped = run(
+                path, journal_mode, synchronous, args.n * 20, True
+            )
+            note = f'  ({dropped} dropped)' if dropped else ''
+            print(f'{journal_mode:8s} {synchronous:12s}'
+                  f' {single:12,.0f} {batched:12,.0f}{note}')
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+Cost of the interactive display on the packet processing thread.
+Runs Display in a pseudo terminal and feeds it what the server does
+on a busy bus: --rate received frames per second are shown, every
+10th one changes the status and Display.loop runs once per frame.
+Reports the time per frame spent in the display and the bytes
+written to the terminal.
+"""
+import os
+import sys
+import pty
+import time
+import fcntl
+import struct
+import select
+import termios
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+# pylint: disable=wrong-import-position
+from toshiba import Aircon  # noqa: E402
+
+FRAMES = [
+    bytes.fromhex('00fe580a808129400000727600002b'),
+    bytes.fromhex('00fe1c08808129400000727630'),
+    bytes.fromhex('00421a0780ef80002c002b'),
+    bytes.fromhex('0052110408520102'),
+]
+
+
+def run(n, rate, result_fd):
+    from display import Display  # pylint: disable=import-outside-toplevel
+    fcntl.ioctl(0, termios.TIOCSWINSZ, struct.pack('HHHH', 40, 120, 0, 0))
+    ac = Aircon(0x42)
+    ac.parse(FRAMES[0])
+    ac.sensor = dict.fromkeys(
+        (0x02, 0x03, 0x04, 0x60, 0x61, 0x62, 0x63, 0x65, 0x6a), 0
+    )
+    disp = Display()
+    elapsed = 0.0
+    start = time.perf_counter()
+    for i in range(n):
+        delay = start + i / rate - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        t0 = time.perf_counter()
+        p = FRAMES[i % len(FRAMES)]
+        disp.on_rx_packet(p, ac)
+        if i % 10 == 0:
+            ac.temp2 = 20 + i % 7
+            disp.disp_status(ac)
+        disp.loop(ac)
+        elapsed += time.perf_counter() - t0
+    disp.quit()
+    os.write(result_fd, f'{elapsed}\n'.encode())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', type=int, default=5000,
+                        help='frames, default 5000')
+    parser.add_argument('--rate', type=float, default=1000.0,
+                        help='frames per second, default 1000')
+    args = parser.parse_args()
+
+    result_r, result_w = os.pipe()
+    os.environ.setdefault('TERM', 'xterm')
+    pid, master = pty.fork()
+    if pid == 0:
+        try:
+            run(args.n, args.rate, result_w)
+        finally:
+            os._exit(0)  # pylint: disable=protected-access
+    os.close(result_w)
+    written = 0
+    while True:
+        try:
+            ready, _, _ = select.select([master], [], [], 1.0)
+            if ready:
+                data = os.read(master, 65536)
+                if not data:
+                    break
+                written += len(data)
+            elif os.waitpid(pid, os.WNOHANG)[0]:
+                break
+        except OSError:
+            break
+    elapsed = float(os.read(result_r, 64).decode() or 'nan')
+    print(f'{args.n} frames: {elapsed / args.n * 1e6:.1f} us/frame,'
+          f' {written / args.n:.0f} terminal bytes/frame')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,225 @@
+"""
+Microbenchmark of the command/query state machine against the previous
+implementation on transitions.Machine with Timeout states. Runs command
+cycles (idle -> cmd -> wstat -> idle) and query cycles with one retry
+(idle -> query1 -> query1 -> idle) and reports transitions per second
+and threads started per transition.
+The previous implementation needs the transitions package, it is
+skipped when that is not installed.
+"""
+import os
+import sys
+import time
+import argparse
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+# pylint: disable=wrong-import-position
+from toshiba import StateMachine, State, CmdSetting, CONFIRMS  # noqa: E402
+
+try:
+    from transitions import Machine
+    from transitions.extensions.states import add_state_features, Timeout
+except ImportError:
+    Machine = None
+
+TRANSITIONS_PER_CYCLE = 6
+
+
+class FakeAircon():
+    """The attributes of Aircon the state machine uses."""
+
+    def __init__(self):
+        self.transmit = self.send
+        self.state_cb = None
+        self.start_cb = None
+        self.ready_cb = None
+        self.humid = None
+        self.machine = None
+        # the status does not show the command yet, so WSTAT waits
+        # for the idle of the cycle like on the bus
+        self.fan_lv = 2
+        self.cmd_settings = (CmdSetting('fan_lv', 3),)
+        self.sent = 0
+
+    def send(self, *_args):
+        self.sent += 1
+
+    def wakeup(self):
+        pass
+
+    def toggle_humid(self):
+        pass
+
+    def confirm(self):
+        """Aircon.confirm, called by the machine on entering WSTAT."""
+        name = CONFIRMS.get(self.machine.state)
+        if name is None or not getattr(self, name)():
+            return
+        self.cmd_settings = ()
+        self.machine.idle()
+
+    def wstat_confirmed(self):
+        return all(
+            getattr(self, s.var) == s.value for s in self.cmd_settings
+        )
+
+
+def legacy_machine_class():
+    """The previous StateMachine, trimmed to what the cycles use."""
+
+    @add_state_features(Timeout)
+    class CustomMachine(Machine):
+        pass
+
+    states = [
+        {
+            'name': State.START,
+            'on_enter': 'start_enter', 'on_exit': 'start_exit'
+        },
+        State.IDLE,
+        {
+            'name': State.CMD, 'timeout': 1.0,
+            'on_timeout': 'send_timeout', 'on_exit': 'send_exit'
+        },
+        {
+            'name': State.WSTAT, 'timeout': 2.0,
+            'on_timeout': 'wstat_timeout', 'on_exit': 'wstat_exit'
+        },
+        {
+            'name': State.QUERY1, 'timeout': 1.0,
+            'on_timeout': 'send_timeout', 'on_exit': 'send_exit'
+        },
+    ]
+
+    class LegacyStateMachine(object):
+
+        def __init__(self, ac):
+            self.ac = ac
+            self.callback = None
+            self.retry = 0
+            self.machine = CustomMachine(
+                model=self, states=states, initial=State.START,
+                auto_transitions=False, send_event=True,
+                before_state_change='state_change'
+            )
+            self.machine.add_transition(
+                trigger='idle',
+                source=[State.START, State.CMD, State.WSTAT, State.QUERY1],
+                dest=State.IDLE,
+            )
+            self.machine.add_transition(
+                trigger='cmd', source=[State.IDLE, State.WSTAT],
+                dest=State.CMD, after='send_packet', unless='rx_only'
+            )
+            self.machine.add_transition(
+                trigger='wstat', source=State.CMD, dest=State.WSTAT,
+            )
+            self.machine.add_transition(
+                trigger='query1', source=State.IDLE, dest=State.QUERY1,
+                after='send_packet', unless='rx_only'
+            )
+            self.machine.add_transition(
+                trigger='self', source=[State.CMD, State.QUERY1], dest='=',
+            )
+
+        def state_change(self, event):
+            if callable(self.ac.state_cb):
+                self.ac.state_cb(str(event.transition.dest).lower())
+            self.ac.wakeup()
+
+        def start_enter(self, _event):
+            pass
+
+        def start_exit(self, _event):
+            pass
+
+        def rx_only(self, _event):
+            return self.ac.transmit is None
+
+        def send_packet(self, event):
+            self.retry = 0
+            callback = event.kwargs.get('callback')
+            if callback is not None:
+                self.callback = callback
+            func, args = self.callback
+            func(*args)
+
+        def send_timeout(self, _event):
+            pass
+
+        def send_exit(self, event):
+            if (event.transition.dest != event.transition.source
+                    and event.transition.dest != State.WSTAT.name):
+                self.callback = None
+
+        def wstat_timeout(self, _event):
+            pass
+
+        def wstat_exit(self, event):
+            if event.transition.dest != State.CMD.name:
+                self.callback = None
+
+    return LegacyStateMachine
+
+
+def cycles(machine, ac, n):
+    callback = (ac.send, ())
+    for _ in range(n):
+        machine.cmd(callback=callback)
+        machine.wstat()
+        machine.idle()
+        machine.query1(callback=callback)
+        machine.self()
+        machine.idle()
+
+
+def run(cls, n):
+    ac = FakeAircon()
+    machine = cls(ac)
+    ac.machine = machine
+    machine.idle()
+
+    started = [0]
+    thread_start = threading.Thread.start
+
+    def counting_start(thread):
+        started[0] += 1
+        thread_start(thread)
+
+    threading.Thread.start = counting_start
+    try:
+        t0 = time.perf_counter()
+        cycles(machine, ac, n)
+        elapsed = time.perf_counter() - t0
+    finally:
+        threading.Thread.start = thread_start
+    return elapsed, started[0], ac.sent
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', type=int, default=20000,
+                        help='number of command and query cycles')
+    args = parser.parse_args()
+
+    candidates = [('native', StateMachine)]
+    if Machine is None:
+        print('transitions not installed, skipping the previous machine')
+    else:
+        candidates.append(('transitions', legacy_machine_class()))
+
+    for name, cls in candidates:
+        n = args.n if name == 'native' else max(args.n // 10, 1)
+        elapsed, started, sent = run(cls, n)
+        count = n * TRANSITIONS_PER_CYCLE
+        print(
+            f'{name:12s} {count / elapsed:10.0f} transitions/s'
+            f'  {started / count:5.2f} threads/transition'
+            f'  ({sent} packets sent)'
+        )
+
+
+if __name__ == '__main__':
+    main()
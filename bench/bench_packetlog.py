@@ -0,0 +1,177 @@
+"""
+Typical protocol analysis queries on a synthetic packet log, the
+previous hex string schema without indexes against the integer columns
+and indexes of the current packet table. The log spreads -n frames of
+a realistic mix (status broadcasts, parameter frames, queries and
+their replies) over --days days.
+"""
+import os
+import sys
+import time
+import shutil
+import sqlite3
+import tempfile
+import argparse
+import datetime as dt
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+# pylint: disable=wrong-import-position
+from database import DB  # noqa: E402
+
+OLD_SCHEMA = """
+CREATE TABLE packet (
+    id INTEGER NOT NULL, time DATETIME, stat VARCHAR(2),
+    txaddr VARCHAR(2), rxaddr VARCHAR(2), opc1 VARCHAR(2), mode VARCHAR(2),
+    opc2 VARCHAR(2), payload TEXT, rawdata BLOB, PRIMARY KEY (id)
+)
+"""
+
+FRAMES = [
+    ('RX', '00fe580a808129400000727600002b'),
+    ('RX', '00fe1c08808129400000727630'),
+    ('RX', '00fe580a808129400000727600002b'),
+    ('RX', '00fe1c08808129400000727630'),
+    ('RX', '00fe580a808129400000747600002d'),
+    ('RX', '00fe1c08808129400000747636'),
+    ('RX', '00521104084c0102'),
+    ('TX', '4200170808 80ef002c08006a'.replace(' ', '')),
+    ('RX', '00421a0780ef80002c002b'),
+    ('RX', '0042180780e80001000123'),
+]
+
+QUERIES = (
+    (
+        'sensor replies, last week',
+        "SELECT time, rawdata FROM packet WHERE opc1 = '1a' AND opc2 = 'ef'"
+        " AND time >= :week",
+        'SELECT time, rawdata FROM packet WHERE opc1 = 26 AND opc2 = 239'
+        ' AND time >= :week',
+    ),
+    (
+        'frames to 0x42, one day',
+        "SELECT time, rawdata FROM packet WHERE rxaddr = '42'"
+        ' AND time >= :day AND time < :day_end',
+        'SELECT time, rawdata FROM packet WHERE rxaddr = 66'
+        ' AND time >= :day AND time < :day_end',
+    ),
+    (
+        'opcode histogram, one day',
+        'SELECT opc1, opc2, count(*) FROM packet'
+        ' WHERE time >= :day AND time < :day_end GROUP BY opc1, opc2',
+        'SELECT opc1, opc2, count(*) FROM packet'
+        ' WHERE time >= :day AND time < :day_end GROUP BY opc1, opc2',
+    ),
+    (
+        'one hour of frames',
+        'SELECT time, stat, rawdata FROM packet'
+        ' WHERE time >= :day AND time < :hour_end ORDER BY id',
+        'SELECT time, stat, rawdata FROM packet'
+        ' WHERE time >= :day AND time < :hour_end ORDER BY id',
+    ),
+)
+
+
+def synthetic_rows(n, days, start, old):
+    step = dt.timedelta(seconds=days * 86400 / n)
+    frames = [(stat, bytes.fromhex(h)) for stat, h in FRAMES]
+    t = start
+    for i in range(n):
+        stat, p = frames[i % len(frames)]
+        if old:
+            yield (
+                t.isoformat(' ', 'microseconds'), stat, p[0:1].hex(),
+                p[1:2].hex(), p[2:3].hex(), p[4:5].hex(), p[5:6].hex(),
+                p[6:-1].hex(), p
+            )
+        else:
+            yield (
+                t.isoformat(' ', 'microseconds'), stat,
+                p[0], p[1], p[2], p[4], p[5], p
+            )
+        t += step
+
+
+def fill(path, n, days, start, old):
+    conn = sqlite3.connect(path)
+    if old:
+        conn.execute(OLD_SCHEMA)
+        sql = (
+            'INSERT INTO packet (time, stat, txaddr, rxaddr, opc1, mode,'
+            ' opc2, payload, rawdata) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)'
+        )
+    else:
+        DB(f'sqlite:///{path}').close()
+        sql = (
+            'INSERT INTO packet (time, stat, txaddr, rxaddr, opc1, mode,'
+            ' opc2, rawdata) VALUES (?, ?, ?, ?, ?, ?, ?, ?)'
+        )
+    conn.executemany(sql, synthetic_rows(n, days, start, old))
+    conn.commit()
+    conn.close()
+    return os.path.getsize(path)
+
+
+def timed(conn, sql, params, repeat):
+    best = None
+    rows = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        rows = conn.execute(sql, params).fetchall()
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best, len(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', type=int, default=2000000,
+                        help='frames in the log, default 2000000')
+    parser.add_argument('--days', type=float, default=60.0,
+                        help='days the log spans, default 60')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='runs of each query, best is reported')
+    parser.add_argument('--dir', help='directory for the test databases')
+    args = parser.parse_args()
+
+    start = dt.datetime(2023, 1, 1)
+    day = start + dt.timedelta(days=args.days / 2)
+    params = {
+        'week': str(start + dt.timedelta(days=args.days - 7)),
+        'day': str(day),
+        'day_end': str(day + dt.timedelta(days=1)),
+        'hour_end': str(day + dt.timedelta(hours=1)),
+    }
+
+    workdir = tempfile.mkdtemp(dir=args.dir)
+    try:
+        paths = {
+            'old': os.path.join(workdir, 'old.sqlite3'),
+            'new': os.path.join(workdir, 'new.sqlite3'),
+        }
+        for name, path in paths.items():
+            t0 = time.perf_counter()
+            size = fill(path, args.n, args.days, start, name == 'old')
+            print(f'{name} schema: {args.n} rows, {size / 2**20:.0f} MiB,'
+                  f' filled in {time.perf_counter() - t0:.1f} s')
+        conns = {name: sqlite3.connect(path) for name, path in paths.items()}
+        print(f'{"query":28s} {"old ms":>9s} {"new ms":>9s} {"rows":>8s}')
+        for title, old_sql, new_sql in QUERIES:
+            old_time, old_rows = timed(
+                conns['old'], old_sql, params, args.repeat
+            )
+            new_time, new_rows = timed(
+                conns['new'], new_sql, params, args.repeat
+            )
+            if old_rows != new_rows:
+                sys.exit(f'{title}: {old_rows} != {new_rows} rows')
+            print(f'{title:28s} {old_time * 1000:9.1f} {new_time * 1000:9.1f}'
+                  f' {new_rows:8d}  ({old_time / new_time:.0f}x)')
+        for conn in conns.values():
+            conn.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+"""
+Microbenchmark of Aircon.parse against the previous if-chain parser.
+Uses the RX frames of a packet log as corpus when --db is given,
+otherwise a synthetic mix of status broadcasts and query replies.
+"""
+import os
+import sys
+import time
+import struct
+import sqlite3
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+# pylint: disable=wrong-import-position
+from toshiba import Aircon, State  # noqa: E402
+
+
+def checksum(p):
+    ck = 0
+    for c in p:
+        ck ^= c
+    return ck
+
+
+def frame(src, dst, opc1, body):
+    p = [src, dst, opc1, len(body)] + list(body)
+    p.append(checksum(p))
+    return bytes(p)
+
+
+def synthetic_corpus(n):
+    frames = [
+        frame(0x00, 0xfe, 0x58, [0x80, 0x81, 0x29, 0x40, 0x00, 0x00,
+                                 0x72, 0x76, 0x00, 0x00]),
+        frame(0x00, 0xfe, 0x1c, [0x80, 0x81, 0x29, 0x40, 0x00, 0x00,
+                                 0x72, 0x76]),
+        frame(0x00, 0x52, 0x11, [0x08, 0x4c, 0x01, 0x02]),
+        frame(0x00, 0x42, 0x1a, [0x80, 0xef, 0x80, 0x00, 0x2c, 0x00, 0x2b]),
+        frame(0x00, 0x42, 0x18, [0x80, 0xe8, 0x00, 0x01, 0x00, 0x01, 0x23]),
+        frame(0x00, 0x42, 0x18, [0x80, 0xa1]),
+        frame(0x40, 0x00, 0x15, [0x08, 0xe8, 0x00, 0x01, 0x00, 0x9e]),
+    ]
+    return [frames[i % len(frames)] for i in range(n)]
+
+
+def db_corpus(path, n):
+    con = sqlite3.connect(path)
+    rows = con.execute(
+        "SELECT rawdata FROM packet WHERE stat = 'RX' "
+        "AND rawdata IS NOT NULL ORDER BY id LIMIT ?", (n,)
+    )
+    return [bytes(r[0]) for r in rows]
+
+
+class LegacyAircon(Aircon):
+    """Aircon with the nested if-chain parser it used to have."""
+
+    def parse(self, p):
+        if p[0] == 0x00:
+            if p[1] == 0xfe:
+                self.legacy_broadcast(p)
+            elif p[1] == 0x52:
+                self.legacy_params(p)
+            elif p[1] == self.addr:
+                self.legacy_reply(p)
+
+    def legacy_broadcast(self, p):
+        if p[2] == 0x58:
+            payload = p[6:14]
+            self.state1 = payload
+            self.temp2 = (payload[5] >> 1) - 35
+            self.save1 = payload[7] & 0b1
+            if self.state == State.START:
+                # pylint: disable=no-member
+                self.machine.idle()
+            ext = True
+        elif p[2] == 0x1c:
+            payload = p[6:12]
+            self.state2 = payload
+            ext = False
+        if p[2] == 0x58 or p[2] == 0x1c:
+            self.power = payload[0] & 0b1
+            self.mode = (payload[0] >> 5) & 0b111
+            self.save = (payload[0] >> 3) & 0b11
+            self.clean = (payload[1] >> 2) & 0b1
+            self.fan_lv = (payload[1] >> 5) & 0b111
+            self.filter = (payload[2] >> 7) & 0b1
+            self.vent = (payload[2] >> 2) & 0b1
+            self.humid = (payload[2] >> 1) & 0b1
+            self.temp1 = (payload[4] >> 1) - 35
+            if callable(self.status_cb):
+                # pylint: disable=not-callable
+                self.status_cb(ext)
+
+    def legacy_params(self, p):
+        if p[2] == 0x11:
+            self.params = p[6:8]
+
+    def legacy_reply(self, p):
+        if p[2] == 0x18 and p[4] == 0x80 and p[5] == 0xa1:
+            if self.state == State.CMD:
+                # pylint: disable=no-member
+                self.machine.wstat()
+        if p[2] == 0x1a and p[4] == 0x80 and p[5] == 0xef:
+            if self.state == State.QUERY1:
+                if p[8] == 0x2c:
+                    self.sensor[0] = (
+                        struct.unpack('>h', bytes(p[9:11]))[0]
+                    )
+        if p[2] == 0x18 and p[4] == 0x80 and p[5] == 0xe8:
+            if self.state == State.QUERY2:
+                self.extra[0] = p[6:11]
+
+
+def run(classes, corpus, repeat):
+    # alternate between parsers so that both see the same CPU state
+    acs = [cls(0x42) for cls in classes]
+    best = [None] * len(acs)
+    for _ in range(repeat):
+        for i, ac in enumerate(acs):
+            t0 = time.perf_counter()
+            for p in corpus:
+                ac.parse(p)
+            dt = time.perf_counter() - t0
+            best[i] = dt if best[i] is None else min(best[i], dt)
+    return [len(corpus) / dt for dt in best], acs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--db', help='packet log to take RX frames from')
+    parser.add_argument('-n', type=int, default=200000,
+                        help='number of frames in the corpus')
+    parser.add_argument('-r', '--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    if args.db:
+        corpus = db_corpus(args.db, args.n)
+    else:
+        corpus = synthetic_corpus(args.n)
+    if not corpus:
+        sys.exit('empty corpus')
+
+    (legacy, table), (_, ac) = run(
+        (LegacyAircon, Aircon), corpus, args.repeat
+    )
+    print(f'corpus: {len(corpus)} frames')
+    print(f'legacy parser: {legacy:12,.0f} frames/s')
+    print(f'table parser:  {table:12,.0f} frames/s ({table / legacy:.2f}x)')
+    print(f'unknown frames: {ac.unknown_frames // args.repeat}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""
+Packet log write, read and retention cost of one growing SQLite file
+against day partitions. Both hold -n synthetic frames spread over
+--days days, then batches of new frames are committed as the buffered
+writer does, ranges are read through iter_packets and the older half
+of the log is removed. With --compress the closed partitions are
+compressed first and read back through temporary files.
+"""
+import os
+import sys
+import time
+import shutil
+import sqlite3
+import tempfile
+import argparse
+import datetime as dt
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+# pylint: disable=wrong-import-position
+from sqlalchemy import insert  # noqa: E402
+from database import DB, PartitionedDB, Packet, packet_row  # noqa: E402
+from bench_packetlog import fill  # noqa: E402
+
+PACKET = bytes.fromhex('00fe580a808129400000727600002b')
+
+
+def fill_partitions(directory, per_day, days, start):
+    for i in range(days):
+        day = start + dt.timedelta(days=i)
+        path = os.path.join(directory, f'log-{day:%Y%m%d-%H%M%S}.sqlite3')
+        fill(path, per_day, 1, day, False)
+
+
+def delete_before(path, cutoff):
+    """Retention in a single file: delete the rows, then give back space."""
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute('DELETE FROM packet WHERE time < ?', (str(cutoff),))
+    conn.execute('VACUUM')
+    conn.close()
+
+
+def commit_latency(engine, batches, batch_size):
+    rows = [packet_row('RX', PACKET) for _ in range(batch_size)]
+    times = []
+    for _ in range(batches):
+        t0 = time.perf_counter()
+        with engine.begin() as conn:
+            conn.execute(insert(Packet), rows)
+        times.append(time.perf_counter() - t0)
+    times.sort()
+    return times[len(times) // 2], times[int(len(times) * 0.99)]
+
+
+def timed_read(db, start, end):
+    t0 = time.perf_counter()
+    n = sum(1 for _ in db.iter_packets(start, end))
+    return time.perf_counter() - t0, n
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', type=int, default=2000000,
+                        help='frames already in the log, default 2000000')
+    parser.add_argument('--days', type=int, default=60,
+                        help='days the log spans, default 60')
+    parser.add_argument('-b', '--batches', type=int, default=200,
+                        help='batches of 500 frames committed, default 200')
+    parser.add_argument('--compress', choices=('gz', 'xz'),
+                        help='compress the closed partitions')
+    parser.add_argument('--dir', help='directory for the test databases')
+    args = parser.parse_args()
+
+    start = dt.datetime.combine(
+        dt.date.today() - dt.timedelta(days=args.days), dt.time()
+    )
+    day = start + dt.timedelta(days=args.days // 2)
+    ranges = (
+        ('one hour', day, day + dt.timedelta(hours=1)),
+        ('one day', day, day + dt.timedelta(days=1)),
+    )
+
+    workdir = tempfile.mkdtemp(dir=args.dir)
+    try:
+        single_dir = os.path.join(workdir, 'single')
+        part_dir = os.path.join(workdir, 'partitioned')
+        os.mkdir(single_dir)
+        os.mkdir(part_dir)
+        per_day = args.n // args.days
+        single_path = os.path.join(single_dir, 'log.sqlite3')
+        fill(single_path, per_day * args.days, args.days, start, False)
+        fill_partitions(part_dir, per_day, args.days, start)
+
+        single = DB(f'sqlite:///{single_dir}/log.sqlite3')
+        parted = PartitionedDB(
+            f'sqlite:///{part_dir}/log.sqlite3', compress=args.compress
+        )
+        if args.compress:
+            t0 = time.perf_counter()
+            parted.maintain()
+            print(f'compressed {args.days} partitions'
+                  f' in {time.perf_counter() - t0:.1f} s')
+        parted.write_packet('RX', PACKET)  # opens today's partition
+
+        print(f'{"":24s} {"single file":>14s} {"partitioned":>14s}')
+        lat = [
+            commit_latency(db.engine, args.batches, 500)
+            for db in (single, parted.current)
+        ]
+        for i, title in enumerate(('commit p50 ms', 'commit p99 ms')):
+            print(f'{title:24s} {lat[0][i] * 1000:14.2f}'
+                  f' {lat[1][i] * 1000:14.2f}')
+        for title, lo, hi in ranges:
+            single_time, single_rows = timed_read(single, lo, hi)
+            parted_time, parted_rows = timed_read(parted, lo, hi)
+            if single_rows != parted_rows:
+                sys.exit(f'{title}: {single_rows} != {parted_rows} rows')
+            print(f'{"read " + title + " ms":24s}'
+                  f' {single_time * 1000:14.1f} {parted_time * 1000:14.1f}'
+                  f'  ({parted_rows} rows)')
+        single.close()
+        keep_days = args.days // 2
+        t0 = time.perf_counter()
+        delete_before(
+            single_path, dt.datetime.now() - dt.timedelta(days=keep_days)
+        )
+        single_time = time.perf_counter() - t0
+        parted.keep_days = keep_days
+        t0 = time.perf_counter()
+        parted.maintain()
+        parted_time = time.perf_counter() - t0
+        print(f'{"drop older half s":24s}'
+              f' {single_time:14.2f} {parted_time:14.2f}')
+        parted.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
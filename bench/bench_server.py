@@ -0,0 +1,192 @@
+"""
+Load benchmark of server.py against an in-process MQTT broker and a
+simulated indoor unit. Drives status broadcasts at a fixed rate while
+sending control requests and reports processed messages/s, latency
+from control request to command TX and to confirmed status, and
+server CPU time per message (Linux only).
+Arguments after -- are passed to server.py.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import argparse
+import threading
+import subprocess
+
+from paho.mqtt import client as mqtt_client
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+# pylint: disable=wrong-import-position
+from broker import Broker  # noqa: E402
+from indoor_unit import IndoorUnit, set_nodelay  # noqa: E402
+
+REPO = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+CLIENT_ID = 'bench-processor'
+
+
+def process_cpu(pid):
+    try:
+        with open(f'/proc/{pid}/stat', encoding='ascii') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def percentile(values, p):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(int(len(values) * p / 100), len(values) - 1)]
+
+
+class Monitor():
+    """Follows the internal state the processor publishes."""
+
+    def __init__(self, host, port, topic):
+        self.ready = threading.Event()
+        self.updated = threading.Event()
+        self.confirmed = threading.Event()
+        self.in_wstat = False
+        self.client = mqtt_client.Client('bench-monitor')
+        self.client.on_message = self.on_message
+        self.client.connect(host, port)
+        set_nodelay(self.client)
+        self.client.subscribe(f'{topic}/client/processor')
+        self.client.subscribe(f'{topic}/update')
+        self.client.loop_start()
+
+    def on_message(self, _client, _userdata, msg):
+        if msg.topic.endswith('/update'):
+            self.updated.set()
+            return
+        data = json.loads(msg.payload)
+        if data.get('state') == 'ready':
+            self.ready.set()
+        state = data.get('internal_state')
+        if state == 'wstat':
+            self.in_wstat = True
+        elif state == 'idle' and self.in_wstat:
+            self.in_wstat = False
+            self.confirmed.set()
+
+    def close(self):
+        self.client.loop_stop()
+        self.client.disconnect()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rate', type=float, default=50.0,
+                        help='status broadcasts per second, default 50')
+    parser.add_argument('--commands', type=int, default=200,
+                        help='number of control requests, default 200')
+    parser.add_argument('--duration', type=float, default=10.0,
+                        help='seconds to spread the requests over')
+    parser.add_argument('--reply-delay', type=float, default=0.0,
+                        help='simulated bus reply delay in seconds')
+    parser.add_argument('server_args', nargs='*',
+                        help='extra arguments for server.py')
+    args = parser.parse_args()
+
+    broker = Broker().start()
+    workdir = tempfile.mkdtemp()
+    shutil.copy(os.path.join(REPO, 'log_config.json'), workdir)
+    with open(os.path.join(workdir, 'mqtt.conf'), 'w', encoding='utf-8') as f:
+        f.write(
+            f'[broker]\nhost = {broker.host}\nport = {broker.port}\n'
+            f'topic = aircon\n[credentials]\nclient_id = {CLIENT_ID}\n'
+        )
+
+    unit = IndoorUnit(broker.host, broker.port, reply_delay=args.reply_delay)
+    unit.bridge('alive')
+    monitor = Monitor(broker.host, broker.port, 'aircon')
+    control = mqtt_client.Client('bench-control')
+    control.connect(broker.host, broker.port)
+    set_nodelay(control)
+    control.loop_start()
+
+    tx_event = threading.Event()
+
+    def on_tx(p):
+        if p[2] == 0x11:
+            tx_event.set()
+    unit.on_tx = on_tx
+
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(REPO, 'server.py'), '-f', 'mqtt.conf']
+        + args.server_args,
+        cwd=workdir, stdout=subprocess.DEVNULL
+    )
+    stop = threading.Event()
+    load = threading.Thread(
+        target=unit.run_broadcasts, args=(args.rate, stop), daemon=True
+    )
+    try:
+        while not monitor.ready.is_set():
+            unit.broadcast(full=True)
+            if proc.poll() is not None:
+                sys.exit('server.py exited')
+            monitor.ready.wait(0.2)
+        monitor.updated.wait(30)
+        load.start()
+
+        cpu0 = process_cpu(proc.pid)
+        msg0 = broker.delivered(CLIENT_ID)
+        t0 = time.perf_counter()
+        tx_latency = []
+        ack_latency = []
+        lost = 0
+        for i in range(args.commands):
+            tx_event.clear()
+            monitor.confirmed.clear()
+            start = time.perf_counter()
+            control.publish(
+                'aircon/control', json.dumps({'set_temp': 20 + i % 2})
+            )
+            if tx_event.wait(5):
+                tx_latency.append(time.perf_counter() - start)
+            if monitor.confirmed.wait(5):
+                ack_latency.append(time.perf_counter() - start)
+            else:
+                lost += 1
+            delay = t0 + (i + 1) * args.duration / args.commands
+            delay -= time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        elapsed = time.perf_counter() - t0
+        cpu1 = process_cpu(proc.pid)
+        messages = broker.delivered(CLIENT_ID) - msg0
+    finally:
+        stop.set()
+        proc.terminate()
+        proc.wait()
+        monitor.close()
+        control.loop_stop()
+        unit.close()
+        broker.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f'duration:          {elapsed:8.2f} s')
+    print(f'messages in:       {messages:8d} ({messages / elapsed:.0f}/s)')
+    print(f'commands:          {len(ack_latency):8d} confirmed, {lost} lost')
+    for name, lat in (('control->tx', tx_latency),
+                      ('control->ack', ack_latency)):
+        print(
+            f'{name + " ms:":18s} p50 {percentile(lat, 50) * 1000:7.2f}'
+            f'  p99 {percentile(lat, 99) * 1000:7.2f}'
+        )
+    if cpu0 is not None and messages:
+        cpu = cpu1 - cpu0
+        print(
+            f'server cpu:        {cpu:8.2f} s'
+            f' ({cpu / messages * 1e6:.0f} us/message)'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+"""
+Startup time of server.py: from starting the process to its first
+'start' state message on aircon/client/processor, which it publishes
+once it is connected, subscribed and has seen the retained bridge
+'alive' message. Runs against an in-process MQTT broker.
+Arguments after -- are passed to server.py, e.g. -- -p for the
+packet log. --imports starts it once more under -X importtime and
+lists its slowest top level imports and the modules of optional
+features that were loaded.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import argparse
+import threading
+import subprocess
+
+from paho.mqtt import client as mqtt_client
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+# pylint: disable=wrong-import-position
+from broker import Broker  # noqa: E402
+from indoor_unit import IndoorUnit, set_nodelay  # noqa: E402
+from bench_server import REPO, CLIENT_ID, percentile  # noqa: E402
+
+
+class StartMonitor():
+
+    def __init__(self, host, port, topic):
+        self.started = threading.Event()
+        self.client = mqtt_client.Client('bench-startup')
+        self.client.on_message = self.on_message
+        self.client.connect(host, port)
+        set_nodelay(self.client)
+        self.client.subscribe(f'{topic}/client/processor')
+        self.client.loop_start()
+
+    def on_message(self, _client, _userdata, msg):
+        if json.loads(msg.payload).get('state') == 'start':
+            self.started.set()
+
+    def close(self):
+        self.client.loop_stop()
+        self.client.disconnect()
+
+
+# loaded only by the options that need them
+OPTIONAL_MODULES = (
+    'database', 'sqlalchemy', 'aioserver', 'asyncio', 'replay',
+    'profiling', 'display', 'curses', 'http.server',
+)
+
+
+def import_times(command, cwd, env, monitor):
+    """
+    (cumulative microseconds, module) of the top level imports of one
+    start under -X importtime and the set of all imported modules.
+    """
+    monitor.started.clear()
+    proc = subprocess.Popen(
+        command[:1] + ['-X', 'importtime'] + command[1:],
+        cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        env=env, text=True
+    )
+    try:
+        if not monitor.started.wait(30):
+            sys.exit('server.py did not start')
+    finally:
+        proc.terminate()
+        _, err = proc.communicate()
+    top = []
+    modules = set()
+    for line in err.splitlines():
+        fields = line.split('|')
+        if not line.startswith('import time:') or len(fields) != 3:
+            continue
+        if not fields[1].strip().isdigit():
+            continue
+        name = fields[2][1:]
+        modules.add(name.strip())
+        if not name.startswith(' '):
+            top.append((int(fields[1]), name))
+    return sorted(top, reverse=True), modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', type=int, default=10,
+                        help='number of starts, default 10')
+    parser.add_argument('-m', '--module', action='store_true',
+                        help='start it as python -m server')
+    parser.add_argument('--imports', action='store_true',
+                        help='list the import time of one more start')
+    parser.add_argument('server_args', nargs='*',
+                        help='extra arguments for server.py')
+    args = parser.parse_args()
+
+    broker = Broker().start()
+    workdir = tempfile.mkdtemp()
+    os.mkdir(os.path.join(workdir, 'packetlog'))
+    shutil.copy(os.path.join(REPO, 'log_config.json'), workdir)
+    with open(os.path.join(workdir, 'mqtt.conf'), 'w', encoding='utf-8') as f:
+        f.write(
+            f'[broker]\nhost = {broker.host}\nport = {broker.port}\n'
+            f'topic = aircon\n[credentials]\nclient_id = {CLIENT_ID}\n'
+        )
+    env = dict(os.environ)
+    if args.module:
+        command = [sys.executable, '-m', 'server']
+        env['PYTHONPATH'] = os.path.abspath(REPO)
+    else:
+        command = [sys.executable, os.path.join(REPO, 'server.py')]
+    unit = IndoorUnit(broker.host, broker.port)
+    unit.bridge('alive')
+    monitor = StartMonitor(broker.host, broker.port, 'aircon')
+    # the retained 'start' of an earlier run arrives on subscribe
+    time.sleep(0.5)
+    times = []
+    try:
+        for _ in range(args.n):
+            monitor.started.clear()
+            t0 = time.perf_counter()
+            proc = subprocess.Popen(
+                command + ['-f', 'mqtt.conf'] + args.server_args,
+                cwd=workdir, stdout=subprocess.DEVNULL, env=env
+            )
+            try:
+                if not monitor.started.wait(30):
+                    sys.exit('server.py did not start')
+                times.append(time.perf_counter() - t0)
+            finally:
+                proc.terminate()
+                proc.wait()
+        if args.imports:
+            top, modules = import_times(
+                command + ['-f', 'mqtt.conf'] + args.server_args,
+                workdir, env, monitor
+            )
+    finally:
+        monitor.close()
+        unit.close()
+        broker.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f'exec to start message, {len(times)} runs:'
+          f' min {min(times) * 1000:.0f} ms,'
+          f' median {percentile(times, 50) * 1000:.0f} ms,'
+          f' max {max(times) * 1000:.0f} ms')
+    if args.imports:
+        print(f'top level imports: {sum(t for t, _ in top) / 1000:.0f} ms')
+        for t, name in top:
+            if t >= 1000:
+                print(f'  {t / 1000:6.1f} ms  {name}')
+        loaded = [m for m in OPTIONAL_MODULES if m in modules]
+        print(f'optional modules loaded: {", ".join(loaded) or "none"}')
+
+
+if __name__ == '__main__':
+    main()
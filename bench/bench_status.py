@@ -0,0 +1,91 @@
+"""
+Microbenchmark of status message construction, the previous linear
+scans over CMDSETS followed by json.dumps of the dict against the
+precomputed JSON fragments of server.status_payload. Checks that both
+give the same text for every sampled status.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+# pylint: disable=wrong-import-position
+from toshiba import (  # noqa: E402
+    Aircon, CMDSETS, STATUS_B0, STATUS_B1, STATUS_B2, TEMPERATURE
+)
+from server import status_payload  # noqa: E402
+
+
+def legacy_bits_to_text(cmdtype, bits):
+    text = f'{bits:b}'
+    for csi in getattr(CMDSETS, cmdtype):
+        if csi.bits == bits:
+            text = csi.text
+            break
+    return text
+
+
+def legacy_payload(ac):
+    data = {
+        'power': legacy_bits_to_text('power', ac.power),
+        'mode': legacy_bits_to_text('mode', ac.mode),
+        'clean': 'on' if ac.clean == 1 else 'off',
+        'fanlv': legacy_bits_to_text('fan', ac.fan_lv),
+        'settmp': ac.temp1,
+        'temp': ac.temp2,
+        'filter': 'on' if ac.filter == 1 else 'off',
+        'vent': 'on' if ac.vent == 1 else 'off',
+        'save': legacy_bits_to_text('save', ac.save),
+        'humid': legacy_bits_to_text('humid', ac.humid),
+    }
+    return json.dumps(data)
+
+
+def sample_units(n, seed=1):
+    rnd = random.Random(seed)
+    units = []
+    for _ in range(n):
+        ac = Aircon(0x42)
+        ac.power, ac.mode, ac.save = STATUS_B0[rnd.randrange(256)]
+        ac.clean, ac.fan_lv = STATUS_B1[rnd.randrange(256)]
+        ac.filter, ac.vent, ac.humid = STATUS_B2[rnd.randrange(256)]
+        ac.temp1 = TEMPERATURE[rnd.randrange(256)]
+        ac.temp2 = rnd.choice((None, TEMPERATURE[rnd.randrange(256)]))
+        units.append(ac)
+    return units
+
+
+def measure(func, units, repeat):
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        for ac in units:
+            func(ac)
+    return len(units) * repeat / (time.perf_counter() - t0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', type=int, default=1000,
+                        help='number of sampled status values')
+    parser.add_argument('-r', '--repeat', type=int, default=100,
+                        help='passes over the samples')
+    args = parser.parse_args()
+
+    units = sample_units(args.n)
+    for ac in units:
+        if legacy_payload(ac) != status_payload(ac):
+            sys.exit(f'payloads differ: {legacy_payload(ac)}')
+
+    legacy = measure(legacy_payload, units, args.repeat)
+    table = measure(status_payload, units, args.repeat)
+    print(f'scan + json.dumps: {legacy:12,.0f} messages/s')
+    print(f'fragment tables:   {table:12,.0f} messages/s'
+          f' ({table / legacy:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
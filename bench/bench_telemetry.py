@@ -0,0 +1,167 @@
+"""
+Storage size and range query time of the sensor history, status table
+rows against the telemetry blocks converted from them by
+DB.import_status, and the cost of writing the blocks live. The
+history is synthetic: one update every --interval seconds for --days
+days with random-walk sensor values.
+"""
+import os
+import sys
+import time
+import random
+import shutil
+import sqlite3
+import tempfile
+import argparse
+import datetime as dt
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+# pylint: disable=wrong-import-position
+from sqlalchemy import insert, select  # noqa: E402
+from database import DB, Status  # noqa: E402
+
+KEYS = (
+    'settmp', 'temp', 'pwrlv1', 'pwrlv2', 'sens_ta', 'sens_tcj', 'sens_tc',
+    'sens_te', 'sens_to', 'sens_td', 'sens_ts', 'sens_ths', 'sens_current',
+    'filter_time',
+)
+
+
+def synthetic_status(days, interval, seed=1):
+    rnd = random.Random(seed)
+    values = {key: 20 for key in KEYS}
+    values['filter_time'] = 100
+    t = dt.datetime(2023, 1, 1)
+    step = dt.timedelta(seconds=interval)
+    for i in range(int(days * 86400 / interval)):
+        for key in KEYS:
+            if key == 'sens_current':
+                values[key] = rnd.randrange(40)
+            elif key == 'filter_time':
+                values[key] += i % (3600 // interval or 1) == 0
+            elif rnd.random() < 0.2:
+                values[key] += rnd.choice((-1, 1))
+        row = dict(values)
+        row.update(
+            time=t, power='on', mode='heat', clean='off', fanlv='auto',
+            filter='off', vent='off', humid='off',
+        )
+        yield row
+        t += step
+
+
+def vacuumed_size(path, drop):
+    conn = sqlite3.connect(path, isolation_level=None)
+    for table in drop:
+        conn.execute(f'DROP TABLE IF EXISTS {table}')
+    # leave WAL mode so that the file holds all pages
+    conn.execute('PRAGMA journal_mode = DELETE')
+    conn.execute('VACUUM')
+    conn.close()
+    return os.path.getsize(path)
+
+
+def timed(func, repeat):
+    best = None
+    result = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def time_writes(db, rows):
+    """
+    Write rows through DB.write_telemetry like the server does, return
+    the mean seconds per update over the first and the last tenth.
+    """
+    elapsed = []
+    for row in rows:
+        sample = {key: row[key] for key in KEYS}
+        t0 = time.perf_counter()
+        db.write_telemetry(0, sample, row['time'].timestamp())
+        elapsed.append(time.perf_counter() - t0)
+    n = max(len(elapsed) // 10, 1)
+    return sum(elapsed[:n]) / n, sum(elapsed[-n:]) / n
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--days', type=float, default=30.0,
+                        help='days of history, default 30')
+    parser.add_argument('--interval', type=int, default=60,
+                        help='seconds between updates, default 60')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='runs of each query, best is reported')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(workdir, 'log.sqlite3')
+        db = DB(f'sqlite:///{path}')
+        rows = list(synthetic_status(args.days, args.interval))
+        with db.engine.begin() as conn:
+            conn.execute(insert(Status), rows)
+        t0 = time.perf_counter()
+        db.import_status()
+        convert = time.perf_counter() - t0
+
+        # one day in the middle of the history
+        start = rows[len(rows) // 2]['time']
+        end = start + dt.timedelta(days=1)
+        stmt = select(Status.time, Status.sens_ta).where(
+            Status.time >= start, Status.time < end
+        ).order_by(Status.time)
+
+        def query_status():
+            with db.engine.connect() as conn:
+                return conn.execute(stmt).all()
+
+        status_time, status_rows = timed(query_status, args.repeat)
+        telemetry_time, samples = timed(
+            lambda: db.query_telemetry('sens_ta', start, end), args.repeat
+        )
+        if [tuple(r) for r in status_rows] != samples:
+            sys.exit('telemetry samples differ from the status rows')
+        downsample_time, _ = timed(
+            lambda: db.downsample_telemetry(
+                'sens_ta', rows[0]['time'], rows[-1]['time'], 3600
+            ), args.repeat
+        )
+        db.close()
+        db.engine.dispose()
+
+        # one day written live into an empty database
+        live = DB(f'sqlite:///{os.path.join(workdir, "live.sqlite3")}')
+        day = rows[:86400 // args.interval]
+        write_first, write_last = time_writes(live, day)
+        live.close()
+        live.engine.dispose()
+
+        telemetry_path = os.path.join(workdir, 'telemetry.sqlite3')
+        shutil.copy(path, telemetry_path)
+        status_size = vacuumed_size(path, ('telemetry',))
+        telemetry_size = vacuumed_size(telemetry_path, ('status',))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f'history:           {len(rows)} updates, {len(KEYS)} values each,'
+          f' converted in {convert:.2f} s')
+    print(f'size status:       {status_size / 1024:10.0f} KiB')
+    print(f'size telemetry:    {telemetry_size / 1024:10.0f} KiB'
+          f' ({status_size / telemetry_size:.0f}x smaller)')
+    print(f'one day of sens_ta: status {status_time * 1000:.1f} ms,'
+          f' telemetry {telemetry_time * 1000:.1f} ms'
+          f' ({status_time / telemetry_time:.0f}x), {len(samples)} samples')
+    print(f'hourly downsample of the whole history:'
+          f' {downsample_time * 1000:.1f} ms')
+    print(f'live writes of one day, {len(day)} updates:'
+          f' {write_first * 1000:.2f} ms per update in the first tenth,'
+          f' {write_last * 1000:.2f} ms in the last')
+
+
+if __name__ == '__main__':
+    main()
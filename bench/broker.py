@@ -0,0 +1,206 @@
+"""
+Minimal in-process MQTT 3.1.1 broker for benchmarks.
+Supports CONNECT, PUBLISH (QoS 0/1, retained), SUBSCRIBE with
+wildcards, UNSUBSCRIBE, PINGREQ and DISCONNECT. Everything is
+delivered to subscribers with QoS 0.
+"""
+import socket
+import struct
+import threading
+
+
+def topic_matches(sub, topic):
+    sub_levels = sub.split('/')
+    levels = topic.split('/')
+    for i, s in enumerate(sub_levels):
+        if s == '#':
+            return True
+        if i >= len(levels):
+            return False
+        if s not in ('+', levels[i]):
+            return False
+    return len(sub_levels) == len(levels)
+
+
+def encode_length(n):
+    out = bytearray()
+    while True:
+        b = n & 0x7f
+        n >>= 7
+        if n:
+            out.append(b | 0x80)
+        else:
+            out.append(b)
+            return bytes(out)
+
+
+def publish_packet(topic, payload, retain=False):
+    t = topic.encode()
+    body = struct.pack('>H', len(t)) + t + bytes(payload)
+    return bytes([0x30 | int(retain)]) + encode_length(len(body)) + body
+
+
+class Connection(threading.Thread):
+
+    def __init__(self, broker, sock):
+        super().__init__(daemon=True)
+        self.broker = broker
+        self.sock = sock
+        self.subs = []
+        self.client_id = None
+        self.delivered = 0
+        self.wlock = threading.Lock()
+
+    def send(self, data):
+        with self.wlock:
+            try:
+                self.sock.sendall(data)
+            except OSError:
+                pass
+
+    def recv_exact(self, n):
+        buf = bytearray()
+        while len(buf) < n:
+            chunk = self.sock.recv(n - len(buf))
+            if not chunk:
+                raise ConnectionError
+            buf += chunk
+        return bytes(buf)
+
+    def run(self):
+        try:
+            while True:
+                head = self.recv_exact(1)[0]
+                n, mult = 0, 1
+                while True:
+                    b = self.recv_exact(1)[0]
+                    n += (b & 0x7f) * mult
+                    mult <<= 7
+                    if not b & 0x80:
+                        break
+                body = self.recv_exact(n) if n else b''
+                if not self.handle(head, body):
+                    break
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            self.broker.remove(self)
+            self.sock.close()
+
+    def handle(self, head, body):
+        ptype = head >> 4
+        if ptype == 1:
+            # protocol name, level, flags and keepalive precede client id
+            pos = 2 + struct.unpack_from('>H', body)[0] + 4
+            idlen = struct.unpack_from('>H', body, pos)[0]
+            self.client_id = body[pos + 2:pos + 2 + idlen].decode()
+            self.send(b'\x20\x02\x00\x00')
+        elif ptype == 3:
+            qos = (head >> 1) & 0b11
+            retain = head & 0b1
+            tlen = struct.unpack_from('>H', body)[0]
+            topic = body[2:2 + tlen].decode()
+            pos = 2 + tlen
+            if qos:
+                pid = body[pos:pos + 2]
+                pos += 2
+                self.send(b'\x40\x02' + pid)
+            self.broker.publish(topic, body[pos:], retain)
+        elif ptype == 8:
+            pid = body[:2]
+            pos = 2
+            granted = bytearray()
+            topics = []
+            while pos < len(body):
+                tlen = struct.unpack_from('>H', body, pos)[0]
+                topics.append(body[pos + 2:pos + 2 + tlen].decode())
+                pos += 2 + tlen + 1
+                granted.append(0)
+            self.subs.extend(topics)
+            self.send(
+                b'\x90' + encode_length(2 + len(granted)) + pid
+                + bytes(granted)
+            )
+            self.broker.send_retained(self, topics)
+        elif ptype == 10:
+            self.send(b'\xb0\x02' + body[:2])
+        elif ptype == 12:
+            self.send(b'\xd0\x00')
+        elif ptype == 14:
+            return False
+        return True
+
+    def wants(self, topic):
+        return any(topic_matches(s, topic) for s in self.subs)
+
+
+class Broker():
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, port))
+        self.sock.listen()
+        self.host, self.port = self.sock.getsockname()
+        self.lock = threading.Lock()
+        self.conns = []
+        self.retained = {}
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def serve(self):
+        while True:
+            try:
+                sock, _ = self.sock.accept()
+            except OSError:
+                return
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            conn = Connection(self, sock)
+            with self.lock:
+                self.conns.append(conn)
+            conn.start()
+
+    def remove(self, conn):
+        with self.lock:
+            if conn in self.conns:
+                self.conns.remove(conn)
+
+    def publish(self, topic, payload, retain=False):
+        if retain:
+            with self.lock:
+                if payload:
+                    self.retained[topic] = payload
+                else:
+                    self.retained.pop(topic, None)
+        data = publish_packet(topic, payload)
+        with self.lock:
+            conns = [c for c in self.conns if c.wants(topic)]
+        for conn in conns:
+            conn.delivered += 1
+            conn.send(data)
+
+    def send_retained(self, conn, subs):
+        with self.lock:
+            items = list(self.retained.items())
+        for topic, payload in items:
+            if any(topic_matches(s, topic) for s in subs):
+                conn.send(publish_packet(topic, payload, True))
+
+    def delivered(self, client_id):
+        with self.lock:
+            return sum(
+                c.delivered for c in self.conns if c.client_id == client_id
+            )
+
+    def close(self):
+        self.sock.close()
+        with self.lock:
+            conns = list(self.conns)
+        for conn in conns:
+            try:
+                conn.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
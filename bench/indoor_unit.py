@@ -0,0 +1,163 @@
+"""
+Simulated indoor unit and MQTT bridge for benchmarks.
+Answers the query and command packets generated by toshiba.Aircon,
+optionally after reply_delay seconds of simulated bus time, and
+broadcasts its state on aircon/packet/rx.
+"""
+import json
+import socket
+import threading
+import time
+
+from paho.mqtt import client as mqtt_client
+
+
+def checksum(p):
+    ck = 0
+    for c in p:
+        ck ^= c
+    return ck
+
+
+def set_nodelay(client):
+    # paho leaves Nagle enabled, which adds delayed-ACK stalls
+    # to request/response traffic on loopback
+    sock = client.socket()
+    if sock is not None:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
+def frame(src, dst, opc1, body):
+    p = [src, dst, opc1, len(body)] + list(body)
+    p.append(checksum(p))
+    return bytes(p)
+
+
+class IndoorUnit():
+
+    def __init__(
+            self, host, port, topic='aircon', unit=0x00, reply_delay=0.0):
+        self.topic = topic
+        self.reply_delay = reply_delay
+        self.unit = unit
+        self.power = 1
+        self.mode = 0b001
+        self.save = 0b11
+        self.fan_lv = 0b010
+        self.temp1 = 22
+        self.temp2 = 24
+        self.humid = 0
+        self.filter = 0
+        self.current = 0
+        self.rx_count = 0
+        self.tx_count = 0
+        self.on_tx = None
+        self.lock = threading.Lock()
+        self.client = mqtt_client.Client(f'indoor-unit-{unit}')
+        self.client.on_message = self.on_message
+        self.client.connect(host, port)
+        set_nodelay(self.client)
+        self.client.subscribe(f'{topic}/packet/tx', qos=0)
+        self.client.loop_start()
+
+    def close(self):
+        self.client.loop_stop()
+        self.client.disconnect()
+
+    def bridge(self, connection):
+        payload = json.dumps({'connection': connection})
+        self.client.publish(
+            f'{self.topic}/client/bridge', payload, qos=1, retain=True
+        )
+
+    def state_payload(self):
+        b0 = self.mode << 5 | self.save << 3 | self.power
+        b1 = self.fan_lv << 5
+        b2 = self.filter << 7 | self.humid << 1
+        b4 = (self.temp1 + 35) << 1
+        b5 = (self.temp2 + 35) << 1
+        return [b0, b1, b2, 0x00, b4, b5, 0x00, 0x00]
+
+    def send_rx(self, p):
+        self.rx_count += 1
+        self.client.publish(f'{self.topic}/packet/rx', p)
+
+    def broadcast(self, full=True):
+        with self.lock:
+            payload = self.state_payload()
+        if full:
+            p = frame(self.unit, 0xfe, 0x58, [0x80, 0x81] + payload)
+        else:
+            p = frame(self.unit, 0xfe, 0x1c, [0x80, 0x81] + payload[:6])
+        self.send_rx(p)
+
+    def on_message(self, _client, _userdata, msg):
+        p = msg.payload
+        if p[1] not in (self.unit, 0xfe):
+            return
+        self.tx_count += 1
+        if callable(self.on_tx):
+            self.on_tx(p)
+        addr = p[0]
+        changed = False
+        with self.lock:
+            if p[2] == 0x17 and p[5] == 0x80 and p[6] == 0xef:
+                qid = p[11]
+                value = (qid * 7 + self.current) & 0x7fff
+                self.current = (self.current + 1) & 0xff
+                reply = frame(
+                    self.unit, addr, 0x1a,
+                    [0x80, 0xef, 0x80, 0x00, 0x2c, value >> 8, value & 0xff]
+                )
+            elif p[2] == 0x15 and p[5] == 0xe8:
+                reply = frame(
+                    self.unit, addr, 0x18,
+                    [0x80, 0xe8, 0x00, 0x01, 0x00, 0x01, 0x23]
+                )
+            elif p[2] == 0x11 and p[4] == 0x08:
+                if p[5] == 0x41:
+                    self.power = p[6] & 0b1
+                elif p[5] == 0x42:
+                    self.mode = p[6] & 0b111
+                elif p[5] == 0x4c:
+                    self.mode = p[6] & 0b111
+                    self.fan_lv = p[7] & 0b111
+                    self.temp1 = (p[8] >> 1) - 35
+                elif p[5] == 0x52:
+                    self.humid ^= 1
+                changed = True
+                reply = frame(self.unit, addr, 0x18, [0x80, 0xa1])
+            elif p[1] == 0xfe and p[2] == 0x10 and p[5] == 0x4c:
+                self.save = (p[7] >> 4) & 0b11
+                changed = True
+                reply = None
+            elif p[1] == 0xfe and p[2] == 0x10 and p[5] == 0x4b:
+                self.filter = 0
+                changed = True
+                reply = None
+            else:
+                reply = None
+        if reply is not None:
+            if self.reply_delay > 0:
+                threading.Timer(
+                    self.reply_delay, self.send_rx, (reply,)
+                ).start()
+            else:
+                self.send_rx(reply)
+        if changed:
+            self.broadcast(full=False)
+            self.broadcast(full=True)
+
+    def run_broadcasts(self, rate, stop):
+        interval = 1.0 / rate if rate > 0 else None
+        n = 0
+        t0 = time.monotonic()
+        while not stop.is_set():
+            if interval is None:
+                stop.wait(0.1)
+                continue
+            self.broadcast(full=n % 2 == 0)
+            n += 1
+            delay = t0 + n * interval - time.monotonic()
+            if delay > 0:
+                stop.wait(delay)
@@ -1,43 +1,170 @@
 import datetime as dt
+import os
+import re
+import sys
+import gzip
+import lzma
+import time
+import zlib
+import queue
+import shutil
+import sqlite3
+import tempfile
+import threading
+from array import array
+from bisect import bisect_left
+from itertools import accumulate
+from logging import getLogger
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy import (
-    Column, Integer, String, DateTime, Text, BLOB
+    create_engine, event, func, inspect, insert, select, update
 )
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import declarative_base, sessionmaker, scoped_session
+from sqlalchemy import (
+    Column, Integer, String, DateTime, BLOB, Index
+)
+
+DB_URL = 'sqlite:///packetlog/log.sqlite3'
+BATCH_SIZE = 500  # max rows per transaction in buffered mode
+FLUSH_INTERVAL = 1.0  # max seconds a buffered row waits before commit
+QUEUE_SIZE = 20000  # rows held in memory before dropping
+CHUNK_SIZE = 1000  # rows fetched at once when reading the packet log
+JOURNAL_MODE = 'WAL'
+SYNCHRONOUS = 'NORMAL'  # with WAL, a power loss may undo the last commits
+PAGE_SIZE = 4096  # bytes, only takes effect when the database is created
+CACHE_SIZE = 8192  # KiB of page cache per connection
+CHECKPOINT_INTERVAL = 300.0  # seconds between WAL checkpoints, 0: never
+JOURNAL_MODES = ('DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF')
+SYNCHRONOUS_LEVELS = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+BLOCK_SECONDS = 3600  # time span of one telemetry block
+UNSIGNED_KEYS = ('filter_time',)  # telemetry values stored as uint16
+PARTITION_MODES = ('day', 'size')
+PARTITION_SIZE = 64  # MiB of a packet log partition in size mode
+ROTATE_CHECK = 60.0  # seconds between partition size checks
+DOWNSAMPLE_INTERVAL = 300  # seconds per status row kept in old partitions
+
+logger = getLogger(__name__)
+
+
+def create_db_engine(
+        url, journal_mode=JOURNAL_MODE, synchronous=SYNCHRONOUS,
+        page_size=PAGE_SIZE, cache_size=CACHE_SIZE):
+    """Engine for url, SQLite connections get the given pragmas."""
+    journal_mode = journal_mode.upper()
+    synchronous = synchronous.upper()
+    if journal_mode not in JOURNAL_MODES:
+        raise ValueError(f'invalid journal_mode: {journal_mode}')
+    if synchronous not in SYNCHRONOUS_LEVELS:
+        raise ValueError(f'invalid synchronous: {synchronous}')
+    page_size = int(page_size)
+    cache_size = int(cache_size)
+    engine = create_engine(url)
+    if engine.dialect.name != 'sqlite':
+        return engine
 
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, _connection_record):
+        cursor = dbapi_connection.cursor()
+        # page_size before journal_mode, a WAL database keeps its size
+        cursor.execute(f'PRAGMA page_size = {page_size}')
+        cursor.execute(f'PRAGMA journal_mode = {journal_mode}')
+        cursor.execute(f'PRAGMA synchronous = {synchronous}')
+        cursor.execute(f'PRAGMA cache_size = {-cache_size}')
+        cursor.close()
 
-class BaseEngine(object):
-    def __init__(self, url):
-        self.engine = create_engine(url)
+    return engine
 
 
-class BaseSession(BaseEngine):
-    def __init__(self, url):
-        super().__init__(url)
-        Session = sessionmaker(bind=self.engine)
-        self.session = Session()
+class SchemaError(Exception):
+    """The database was written by an earlier version."""
+
+
+def check_schema(engine):
+    """
+    Raise SchemaError when the tables of engine predate the models.
+    create_all only adds missing tables, it does not change existing
+    ones, and a table it adds would make alembic upgrade fail later.
+    """
+    insp = inspect(engine)
+    tables = insp.get_table_names()
+    outdated = None
+    if 'packet' in tables:
+        columns = {c['name']: c['type'] for c in insp.get_columns('packet')}
+        if not isinstance(columns.get('txaddr'), Integer):
+            outdated = 'packet'
+    if 'status' in tables and outdated is None:
+        columns = {c['name'] for c in insp.get_columns('status')}
+        if 'unit' not in columns:
+            outdated = 'status'
+    if outdated is not None:
+        raise SchemaError(
+            f'{engine.url.database}: the {outdated} table was written by'
+            ' an earlier version, run alembic upgrade head'
+        )
+
+
+def load_options(config):
+    """open_db keyword arguments from the [database] section of config."""
+    if not config.has_section('database'):
+        return {}
+    section = config['database']
+    options = {}
+    for key, conv in (
+            ('url', str), ('journal_mode', str), ('synchronous', str),
+            ('page_size', int), ('cache_size', int),
+            ('checkpoint_interval', float), ('batch_size', int),
+            ('flush_interval', float), ('queue_size', int),
+            ('partition', str), ('partition_size', int), ('compress', str),
+            ('keep_days', int), ('downsample_days', int),
+            ('downsample_interval', int)):
+        if key in section:
+            options[key] = conv(section[key])
+    return options
 
 
 Base = declarative_base()
 
 
 class Packet(Base):
+    """
+    Logged frame, header bytes as integers for indexed lookups. The
+    packet_hex view shows them in hex together with the payload.
+    """
     __tablename__ = 'packet'
+    __table_args__ = (
+        Index('ix_packet_time', 'time'),
+        Index('ix_packet_opcode', 'opc1', 'opc2', 'time'),
+        Index('ix_packet_rxaddr', 'rxaddr', 'time'),
+    )
 
     id = Column('id', Integer, primary_key=True)
     time = Column(DateTime)
     stat = Column(String(2))
-    txaddr = Column(String(2))
-    rxaddr = Column(String(2))
-    opc1 = Column(String(2))
-    mode = Column(String(2))
-    opc2 = Column(String(2))
-    payload = Column(Text)
+    txaddr = Column(Integer)
+    rxaddr = Column(Integer)
+    opc1 = Column(Integer)
+    mode = Column(Integer)
+    opc2 = Column(Integer)
     rawdata = Column(BLOB)
 
 
+PACKET_HEX_VIEW = """
+CREATE VIEW IF NOT EXISTS packet_hex AS
+SELECT id, time, stat,
+    {txaddr} AS txaddr, {rxaddr} AS rxaddr, {opc1} AS opc1,
+    {mode} AS mode, {opc2} AS opc2,
+    CASE WHEN rawdata IS NOT NULL
+        THEN lower(hex(substr(rawdata, 7, length(rawdata) - 7))) END
+        AS payload,
+    rawdata
+FROM packet
+""".format(**{
+    c: f"CASE WHEN {c} IS NOT NULL THEN printf('%02x', {c}) END"
+    for c in ('txaddr', 'rxaddr', 'opc1', 'mode', 'opc2')
+})
+
+
 class Status(Base):
     __tablename__ = 'status'
 
@@ -64,27 +191,244 @@ class Status(Base):
     filter = Column(String(3))
     vent = Column(String(3))
     humid = Column(String(3))
+    unit = Column(Integer)
+
+
+class Telemetry(Base):
+    """
+    One block of a time series: the samples of one key of one unit
+    within BLOCK_SECONDS from start (epoch seconds). times and values
+    hold delta-encoded arrays, see encode_block.
+    """
+    __tablename__ = 'telemetry'
+    __table_args__ = (
+        Index('ix_telemetry_series', 'unit', 'key', 'start', unique=True),
+    )
+
+    id = Column('id', Integer, primary_key=True)
+    unit = Column(Integer, nullable=False)
+    key = Column(String(16), nullable=False)
+    start = Column(Integer, nullable=False)
+    count = Column(Integer, nullable=False)
+    times = Column(BLOB, nullable=False)
+    values = Column(BLOB, nullable=False)
+
+
+def _pack(typecode, items):
+    a = array(typecode, items)
+    if sys.byteorder == 'big':
+        a.byteswap()
+    return zlib.compress(a.tobytes())
+
+
+def _unpack(typecode, data):
+    a = array(typecode)
+    a.frombytes(zlib.decompress(data))
+    if sys.byteorder == 'big':
+        a.byteswap()
+    return a
+
+
+def encode_block(start, times, values):
+    """
+    Pack integer epoch seconds and 16 bit values of one block. Times
+    are stored as uint32 steps from start, values as int16 steps from
+    the previous value, wrapping, both little endian and compressed.
+    """
+    steps = []
+    prev = start
+    for t in times:
+        steps.append(t - prev)
+        prev = t
+    deltas = []
+    prev = 0
+    for v in values:
+        deltas.append(((v - prev + 0x8000) & 0xffff) - 0x8000)
+        prev = v
+    return _pack('I', steps), _pack('h', deltas)
+
+
+def decode_block(start, times, values, signed=True):
+    """Inverse of encode_block, lists of epoch seconds and values."""
+    out_times = list(accumulate(_unpack('I', times), initial=start))[1:]
+    # the running sum is off by multiples of 0x10000 where a step wrapped
+    if signed:
+        out_values = [
+            ((v + 0x8000) & 0xffff) - 0x8000
+            for v in accumulate(_unpack('h', values))
+        ]
+    else:
+        out_values = [v & 0xffff for v in accumulate(_unpack('h', values))]
+    return out_times, out_values
+
+
+class SeriesBlock():
+    """Samples of the open block of one series, kept for appending."""
+    __slots__ = ('id', 'start', 'times', 'values')
+
+    def __init__(self, start, row_id=None, times=None, values=None):
+        self.id = row_id
+        self.start = start
+        self.times = times if times is not None else []
+        self.values = values if values is not None else []
+
+    def row(self):
+        times, values = encode_block(self.start, self.times, self.values)
+        return {'count': len(self.times), 'times': times, 'values': values}
+
+
+def packet_row(stat, packet=None):
+    row = {
+        'time': dt.datetime.now(), 'stat': stat,
+        'txaddr': None, 'rxaddr': None, 'opc1': None, 'mode': None,
+        'opc2': None, 'rawdata': None,
+    }
+    if packet is not None:
+        row['txaddr'] = packet[0]
+        row['rxaddr'] = packet[1]
+        row['opc1'] = packet[2]
+        row['mode'] = packet[4]
+        row['opc2'] = packet[5]
+        row['rawdata'] = bytes(packet)
+    return row
+
+
+class PacketWriter(threading.Thread):
+    """
+    Background writer for the packet table.
+    Rows are queued without blocking the caller and committed
+    in bulk, one transaction per batch.
+    """
+
+    def __init__(
+            self, engine, batch_size=BATCH_SIZE,
+            flush_interval=FLUSH_INTERVAL, queue_size=QUEUE_SIZE):
+        super().__init__(name='packet-writer', daemon=True)
+        self.engine = engine
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.written = 0
+        self.dropped = 0
+
+    def put(self, row):
+        try:
+            self.queue.put_nowait(row)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        self.queue.put(None)
+        self.join()
+        if self.dropped:
+            logger.warning('packet writer dropped %d rows', self.dropped)
+
+    def run(self):
+        done = False
+        while not done:
+            row = self.queue.get()
+            if row is None:
+                break
+            rows = [row]
+            deadline = time.monotonic() + self.flush_interval
+            while len(rows) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    row = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if row is None:
+                    done = True
+                    break
+                rows.append(row)
+            self.flush(rows)
+
+    def flush(self, rows):
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(insert(Packet), rows)
+        except Exception as e:
+            logger.error('packet writer flush failed: %s', e)
+            self.dropped += len(rows)
+        else:
+            self.written += len(rows)
 
 
 class DB():
+    """
+    Packet, status and telemetry storage on one engine. Sessions are
+    per thread, the buffered packet writer uses its own connection
+    from the same pool.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(
+            self, url=DB_URL, buffered=False, journal_mode=JOURNAL_MODE,
+            synchronous=SYNCHRONOUS, page_size=PAGE_SIZE,
+            cache_size=CACHE_SIZE, checkpoint_interval=CHECKPOINT_INTERVAL,
+            **kwargs):
+        self.engine = create_db_engine(
+            url, journal_mode, synchronous, page_size, cache_size
+        )
+        check_schema(self.engine)
+        Base.metadata.create_all(bind=self.engine)
+        if self.engine.dialect.name == 'sqlite':
+            with self.engine.begin() as conn:
+                conn.exec_driver_sql(PACKET_HEX_VIEW)
+        self.session = scoped_session(sessionmaker(bind=self.engine))
+        self.wal = (
+            self.engine.dialect.name == 'sqlite'
+            and journal_mode.upper() == 'WAL'
+        )
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpoint_time = time.monotonic()
+        if buffered:
+            self.writer = PacketWriter(self.engine, **kwargs)
+            self.writer.start()
+        else:
+            self.writer = None
+        self.closed_dropped = 0
+        self.blocks = {}
+
+    @property
+    def dropped(self):
+        if self.writer is not None:
+            return self.closed_dropped + self.writer.dropped
+        return self.closed_dropped
 
-    def __init__(self):
-        url = 'sqlite:///packetlog/log.sqlite3'
-        Base.metadata.create_all(bind=BaseEngine(url).engine)
-        self.session = BaseSession(url).session
+    def checkpoint(self, mode='PASSIVE'):
+        """
+        Copy committed pages from the WAL into the database file.
+        PASSIVE does not wait for other connections, TRUNCATE also
+        empties the WAL file.
+        """
+        self.checkpoint_time = time.monotonic()
+        if not self.wal:
+            return
+        with self.engine.connect() as conn:
+            busy, pages, done = conn.exec_driver_sql(
+                f'PRAGMA wal_checkpoint({mode})'
+            ).one()
+        logger.debug(
+            'checkpoint %s: busy %d, %d of %d pages', mode, busy, done, pages
+        )
+
+    def _check_checkpoint(self):
+        if (self.checkpoint_interval
+                and time.monotonic() - self.checkpoint_time
+                >= self.checkpoint_interval):
+            self.checkpoint()
 
     def write_packet(self, stat, packet=None):
-        p = Packet()
-        p.stat = stat
-        p.time = dt.datetime.now()
-        if packet is not None:
-            p.txaddr = bytes([packet[0]]).hex()
-            p.rxaddr = bytes([packet[1]]).hex()
-            p.opc1 = bytes([packet[2]]).hex()
-            p.mode = bytes([packet[4]]).hex()
-            p.opc2 = bytes([packet[5]]).hex()
-            p.payload = bytes(packet[6:-1]).hex()
-            p.rawdata = bytes(packet)
+        row = packet_row(stat, packet)
+        self._check_checkpoint()
+        if self.writer is not None:
+            self.writer.put(row)
+            return None
+
+        p = Packet(**row)
         self.session.add(p)
         self.session.commit()
 
@@ -95,3 +439,561 @@ class DB():
         s.time = dt.datetime.now()
         self.session.add(s)
         self.session.commit()
+        self._check_checkpoint()
+
+    def _open_block(self, conn, unit, key, start):
+        block = self.blocks.get((unit, key))
+        if block is not None and block.start == start:
+            return block
+        # continue a block written before a restart
+        row = conn.execute(
+            select(Telemetry.id, Telemetry.times, Telemetry.values).where(
+                Telemetry.unit == unit, Telemetry.key == key,
+                Telemetry.start == start
+            )
+        ).first()
+        if row is None:
+            block = SeriesBlock(start)
+        else:
+            times, values = decode_block(
+                start, row.times, row.values, key not in UNSIGNED_KEYS
+            )
+            block = SeriesBlock(start, row.id, times, values)
+        self.blocks[(unit, key)] = block
+        return block
+
+    def write_telemetry(self, unit, sample, t=None):
+        """
+        Append a sample {key: value} to the time series of unit.
+        None values are skipped, the others must fit in 16 bits.
+        """
+        if t is None:
+            t = time.time()
+        t = int(t)
+        start = t - t % BLOCK_SECONDS
+        self._check_checkpoint()
+        with self.engine.begin() as conn:
+            for key, value in sample.items():
+                if value is None:
+                    continue
+                block = self._open_block(conn, unit, key, start)
+                if block.times and block.times[-1] > t:
+                    # clock stepped back
+                    continue
+                block.times.append(t)
+                block.values.append(value)
+                if block.id is None:
+                    block.id = conn.execute(
+                        insert(Telemetry).values(
+                            unit=unit, key=key, start=start, **block.row()
+                        )
+                    ).inserted_primary_key[0]
+                else:
+                    conn.execute(
+                        update(Telemetry).where(Telemetry.id == block.id)
+                        .values(**block.row())
+                    )
+
+    def iter_telemetry(self, key, start=None, end=None, unit=0):
+        """
+        Yield (epoch seconds, value) samples of a series in time order,
+        start inclusive and end exclusive, both datetime or None.
+        """
+        t0 = start.timestamp() if start is not None else None
+        t1 = end.timestamp() if end is not None else None
+        stmt = select(
+            Telemetry.start, Telemetry.times, Telemetry.values
+        ).where(Telemetry.unit == unit, Telemetry.key == key)
+        if t0 is not None:
+            # from the block holding t0, blocks written before
+            # BLOCK_SECONDS was an hour span a day
+            first = select(func.max(Telemetry.start)).where(
+                Telemetry.unit == unit, Telemetry.key == key,
+                Telemetry.start <= t0
+            ).scalar_subquery()
+            stmt = stmt.where(Telemetry.start >= func.coalesce(first, t0))
+        if t1 is not None:
+            stmt = stmt.where(Telemetry.start < t1)
+        stmt = stmt.order_by(Telemetry.start)
+        signed = key not in UNSIGNED_KEYS
+        with self.engine.connect() as conn:
+            for row in conn.execute(stmt):
+                times, values = decode_block(
+                    row.start, row.times, row.values, signed
+                )
+                i = 0 if t0 is None else bisect_left(times, t0)
+                j = len(times) if t1 is None else bisect_left(times, t1)
+                yield from zip(times[i:j], values[i:j])
+
+    def query_telemetry(self, key, start=None, end=None, unit=0):
+        """List of (datetime, value) samples of a series."""
+        fromtimestamp = dt.datetime.fromtimestamp
+        return [
+            (fromtimestamp(t), v)
+            for t, v in self.iter_telemetry(key, start, end, unit)
+        ]
+
+    def downsample_telemetry(self, key, start, end, interval, unit=0):
+        """
+        Samples of a series aggregated into interval seconds buckets,
+        as a list of (bucket start datetime, min, mean, max, count).
+        """
+        buckets = []
+        current = None
+        for t, v in self.iter_telemetry(key, start, end, unit):
+            b = t - t % interval
+            if current is None or current[0] != b:
+                current = [b, v, 0, v, 0]
+                buckets.append(current)
+            if v < current[1]:
+                current[1] = v
+            if v > current[3]:
+                current[3] = v
+            current[2] += v
+            current[4] += 1
+        return [
+            (dt.datetime.fromtimestamp(b), lo, total / n, hi, n)
+            for b, lo, total, hi, n in buckets
+        ]
+
+    def import_status(self, chunk_size=CHUNK_SIZE):
+        """
+        Convert the numeric columns of the status table to telemetry
+        blocks, for history recorded before telemetry was enabled.
+        Returns the number of status rows read.
+        """
+        columns = (
+            'settmp', 'temp', 'pwrlv1', 'pwrlv2', 'sens_ta', 'sens_tcj',
+            'sens_tc', 'sens_te', 'sens_to', 'sens_td', 'sens_ts',
+            'sens_ths', 'sens_current', 'filter_time',
+        )
+        stmt = select(
+            Status.time, Status.unit,
+            *(getattr(Status, c) for c in columns)
+        ).order_by(Status.id)
+        blocks = {}
+        count = 0
+
+        def flush(conn, done):
+            rows = []
+            for (unit, key), block in list(blocks.items()):
+                if done is None or block.start < done:
+                    rows.append(dict(
+                        unit=unit, key=key, start=block.start, **block.row()
+                    ))
+                    del blocks[(unit, key)]
+            if rows:
+                conn.execute(insert(Telemetry), rows)
+
+        with self.engine.begin() as conn:
+            result = conn.execution_options(
+                stream_results=True, yield_per=chunk_size
+            ).execute(stmt)
+            for row in result:
+                count += 1
+                t = int(row[0].timestamp())
+                start = t - t % BLOCK_SECONDS
+                unit = row[1] or 0
+                for key, value in zip(columns, row[2:]):
+                    if value is None:
+                        continue
+                    block = blocks.get((unit, key))
+                    if block is None or block.start != start:
+                        if block is not None:
+                            flush(conn, start)
+                        block = SeriesBlock(start)
+                        blocks[(unit, key)] = block
+                    if block.times and block.times[-1] > t:
+                        continue
+                    block.times.append(t)
+                    block.values.append(value)
+            flush(conn, None)
+        self.blocks.clear()
+        return count
+
+    def iter_packets(self, start=None, end=None, chunk_size=CHUNK_SIZE):
+        """
+        Stream (time, stat, rawdata) rows of the packet log in id order,
+        fetching chunk_size rows at a time.
+        """
+        stmt = select(Packet.time, Packet.stat, Packet.rawdata)
+        if start is not None:
+            stmt = stmt.where(Packet.time >= start)
+        if end is not None:
+            stmt = stmt.where(Packet.time < end)
+        stmt = stmt.order_by(Packet.id)
+        with self.engine.connect() as conn:
+            result = conn.execution_options(
+                stream_results=True, yield_per=chunk_size
+            ).execute(stmt)
+            for rows in result.partitions():
+                yield from rows
+
+    def iter_status(self, start=None, end=None, chunk_size=CHUNK_SIZE):
+        """Stream Status rows of the status log in id order."""
+        stmt = select(Status)
+        if start is not None:
+            stmt = stmt.where(Status.time >= start)
+        if end is not None:
+            stmt = stmt.where(Status.time < end)
+        stmt = stmt.order_by(Status.id)
+        with self.engine.connect() as conn:
+            result = conn.execution_options(
+                stream_results=True, yield_per=chunk_size
+            ).execute(stmt)
+            for rows in result.partitions():
+                yield from rows
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.closed_dropped += self.writer.dropped
+            self.writer = None
+        self.session.remove()
+        try:
+            self.checkpoint('TRUNCATE')
+        except Exception as e:
+            logger.error('final checkpoint failed: %s', e)
+        self.engine.dispose()
+
+
+PARTITION_NAME = re.compile(
+    r'-(\d{8}-\d{6})(-ds)?\.sqlite3(\.gz|\.xz)?$'
+)
+COMPRESSORS = {'gz': gzip.open, 'xz': lzma.open}
+PARTITION_OPTIONS = (
+    'partition_size', 'compress', 'keep_days', 'downsample_days',
+    'downsample_interval',
+)
+
+
+class Partition():
+    """File of a partitioned log, parsed from its name."""
+    __slots__ = ('path', 'start', 'downsampled', 'compressed')
+
+    def __init__(self, path, start, downsampled=False, compressed=None):
+        self.path = path
+        self.start = start
+        self.downsampled = downsampled
+        self.compressed = compressed
+
+
+class PartitionArchiver(threading.Thread):
+    """
+    Closes rotated partitions and runs the retention policy off the
+    write path. put(db, path) closes db first, put(None) only maintains.
+    """
+
+    def __init__(self, log):
+        super().__init__(name='partition-archiver', daemon=True)
+        self.log = log
+        self.queue = queue.Queue()
+
+    def put(self, db, path=None):
+        self.queue.put((db, path))
+
+    def close(self):
+        self.queue.put(None)
+        self.join()
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            db, path = item
+            try:
+                if db is not None:
+                    db.close()
+                    self.log.closed_dropped += db.dropped
+                    self.log.closing.discard(path)
+                self.log.maintain()
+            except Exception as e:
+                logger.error('partition maintenance failed: %s', e)
+
+
+class PartitionedDB():
+    """
+    Packet and status log split into SQLite files next to the main
+    database, a new one every day or when the current one exceeds
+    partition_size MiB, so the file written to stays small. Telemetry
+    stays in the main database. Closed partitions are compressed,
+    downsampled and deleted by a background thread according to
+    compress, downsample_days and keep_days, and reads fan out over
+    the partitions of the requested time range.
+    """
+
+    # pylint: disable=too-many-arguments, too-many-instance-attributes
+    def __init__(
+            self, url=DB_URL, partition='day', partition_size=PARTITION_SIZE,
+            compress=None, keep_days=0, downsample_days=0,
+            downsample_interval=DOWNSAMPLE_INTERVAL, buffered=False,
+            **kwargs):
+        path = make_url(url).database
+        if not url.startswith('sqlite') or not path or path == ':memory:':
+            raise ValueError('partitioning needs an SQLite database file')
+        if partition not in PARTITION_MODES:
+            raise ValueError(f'invalid partition: {partition}')
+        compress = compress or None
+        if compress is not None and compress not in COMPRESSORS:
+            raise ValueError(f'invalid compress: {compress}')
+        self.directory, name = os.path.split(os.path.abspath(path))
+        self.prefix = os.path.splitext(name)[0]
+        self.partition = partition
+        self.partition_size = partition_size * 2**20
+        self.compress = compress
+        self.keep_days = keep_days
+        self.downsample_days = downsample_days
+        self.downsample_interval = downsample_interval
+        self.buffered = buffered
+        self.kwargs = kwargs
+        self.main = DB(url, **kwargs)
+        self.current = None
+        self.current_path = None
+        self.rotate_at = 0.0
+        self.closed_dropped = 0
+        self.closing = set()
+        self.lock = threading.Lock()
+        self.archiver = None
+
+    @property
+    def dropped(self):
+        if self.current is not None:
+            return self.closed_dropped + self.current.dropped
+        return self.closed_dropped
+
+    def partitions(self):
+        """Partition files sorted by start time."""
+        parts = []
+        for name in os.listdir(self.directory):
+            if not name.startswith(self.prefix + '-'):
+                continue
+            m = PARTITION_NAME.match(name, len(self.prefix))
+            if m is None:
+                continue
+            parts.append(Partition(
+                os.path.join(self.directory, name),
+                dt.datetime.strptime(m.group(1), '%Y%m%d-%H%M%S'),
+                m.group(2) is not None,
+                m.group(3)[1:] if m.group(3) else None
+            ))
+        parts.sort(key=lambda p: p.start)
+        return parts
+
+    def _size(self):
+        """Bytes of the current partition, pages still in the WAL count."""
+        with self.current.engine.connect() as conn:
+            pages = conn.exec_driver_sql('PRAGMA page_count').scalar()
+            page_size = conn.exec_driver_sql('PRAGMA page_size').scalar()
+        return pages * page_size
+
+    def _next_rotation(self, start):
+        """Epoch of the next rotation check."""
+        if self.partition == 'day':
+            midnight = dt.datetime.combine(
+                start.date() + dt.timedelta(days=1), dt.time()
+            )
+            return midnight.timestamp()
+        return time.time() + ROTATE_CHECK
+
+    def _open(self, now, resume):
+        """
+        Open the partition to write to, with resume the newest one when
+        it is still current, otherwise a new one starting at now.
+        """
+        parts = [
+            p for p in self.partitions()
+            if not p.compressed and not p.downsampled
+        ]
+        if resume and parts and (
+                self.partition == 'day'
+                and parts[-1].start.date() == now.date()
+                or self.partition == 'size'
+                and os.path.getsize(parts[-1].path) < self.partition_size):
+            path, start = parts[-1].path, parts[-1].start
+        else:
+            path = os.path.join(
+                self.directory, f'{self.prefix}-{now:%Y%m%d-%H%M%S}.sqlite3'
+            )
+            start = now
+            logger.info('new log partition %s', path)
+        self.current = DB(
+            f'sqlite:///{path}', buffered=self.buffered, **self.kwargs
+        )
+        self.current_path = path
+        self.rotate_at = self._next_rotation(start)
+
+    def _check_rotate(self):
+        if time.time() < self.rotate_at:
+            return
+        old, old_path = self.current, self.current_path
+        if old is not None:
+            if (self.partition == 'size'
+                    and self._size() < self.partition_size):
+                self.rotate_at = self._next_rotation(None)
+                return
+            # sessions are per thread, the archiver cannot release ours
+            old.session.remove()
+            self.closing.add(old_path)
+            self.current = None
+        self._open(dt.datetime.now(), resume=old is None)
+        if self.archiver is None:
+            self.archiver = PartitionArchiver(self)
+            self.archiver.start()
+        self.archiver.put(old, old_path)
+
+    def write_packet(self, stat, packet=None):
+        self._check_rotate()
+        return self.current.write_packet(stat, packet)
+
+    def write_status(self, status):
+        self._check_rotate()
+        self.current.write_status(status)
+
+    def write_telemetry(self, unit, sample, t=None):
+        self.main.write_telemetry(unit, sample, t)
+
+    def query_telemetry(self, key, start=None, end=None, unit=0):
+        return self.main.query_telemetry(key, start, end, unit)
+
+    def downsample_telemetry(self, key, start, end, interval, unit=0):
+        return self.main.downsample_telemetry(
+            key, start, end, interval, unit
+        )
+
+    def _select(self, start, end):
+        parts = self.partitions()
+        for i, part in enumerate(parts):
+            if end is not None and part.start >= end:
+                break
+            if (start is not None and i + 1 < len(parts)
+                    and parts[i + 1].start <= start):
+                continue
+            yield part
+
+    def _iter(self, method, start, end, chunk_size):
+        for part in self._select(start, end):
+            if part.path == self.current_path:
+                yield from getattr(self.current, method)(
+                    start, end, chunk_size
+                )
+                continue
+            # keep the archiver from replacing the file while reading it
+            with self.lock:
+                part = self._resolve(part)
+                if part is None:
+                    continue
+                path = part.path
+                if part.compressed:
+                    path = self._decompress(part)
+                db = DB(f'sqlite:///{path}', checkpoint_interval=0)
+                try:
+                    yield from getattr(db, method)(start, end, chunk_size)
+                finally:
+                    db.close()
+                    if path != part.path:
+                        os.remove(path)
+
+    def _resolve(self, part):
+        """part as it is now named, None once it is deleted."""
+        if os.path.exists(part.path):
+            return part
+        for p in self.partitions():
+            if p.start == part.start:
+                return p
+        return None
+
+    def iter_packets(self, start=None, end=None, chunk_size=CHUNK_SIZE):
+        """(time, stat, rawdata) rows of all partitions in the range."""
+        yield from self._iter('iter_packets', start, end, chunk_size)
+
+    def iter_status(self, start=None, end=None, chunk_size=CHUNK_SIZE):
+        """Status rows of all partitions in the range."""
+        yield from self._iter('iter_status', start, end, chunk_size)
+
+    def _decompress(self, part):
+        fd, path = tempfile.mkstemp(
+            suffix='.sqlite3', prefix=self.prefix + '.', dir=self.directory
+        )
+        with os.fdopen(fd, 'wb') as dst, \
+                COMPRESSORS[part.compressed](part.path, 'rb') as src:
+            shutil.copyfileobj(src, dst, 2**20)
+        return path
+
+    def maintain(self):
+        """Apply the retention policy to the closed partitions."""
+        now = dt.datetime.now()
+        for part in self.partitions()[:-1]:
+            if part.path == self.current_path or part.path in self.closing:
+                continue
+            age = now - part.start
+            with self.lock:
+                if (self.keep_days
+                        and age > dt.timedelta(days=self.keep_days)):
+                    logger.info('deleting log partition %s', part.path)
+                    os.remove(part.path)
+                    continue
+                if (self.downsample_days and not part.downsampled
+                        and age > dt.timedelta(days=self.downsample_days)):
+                    part = self._downsample(part)
+                if self.compress and not part.compressed:
+                    self._compress(part)
+
+    def _downsample(self, part):
+        """
+        Drop the packets of a partition and keep one status row per
+        downsample_interval seconds and unit.
+        """
+        path = part.path
+        if part.compressed:
+            path = self._decompress(part)
+        conn = sqlite3.connect(path, isolation_level=None)
+        try:
+            conn.execute('PRAGMA journal_mode = DELETE')
+            conn.execute('DELETE FROM packet')
+            conn.execute(
+                'DELETE FROM status WHERE id NOT IN ('
+                ' SELECT min(id) FROM status GROUP BY unit,'
+                " CAST(strftime('%s', time) AS INTEGER) / ?)",
+                (int(self.downsample_interval),)
+            )
+            conn.execute('VACUUM')
+        finally:
+            conn.close()
+        base = PARTITION_NAME.sub('', part.path)
+        dst = f'{base}-{part.start:%Y%m%d-%H%M%S}-ds.sqlite3'
+        os.replace(path, dst)
+        if part.compressed:
+            os.remove(part.path)
+        logger.info('downsampled log partition %s', dst)
+        return Partition(dst, part.start, True, None)
+
+    def _compress(self, part):
+        dst = f'{part.path}.{self.compress}'
+        tmp = dst + '.tmp'
+        with open(part.path, 'rb') as src, \
+                COMPRESSORS[self.compress](tmp, 'wb') as out:
+            shutil.copyfileobj(src, out, 2**20)
+        os.replace(tmp, dst)
+        os.remove(part.path)
+        logger.info('compressed log partition %s', dst)
+
+    def close(self):
+        if self.current is not None:
+            self.current.close()
+            self.closed_dropped += self.current.dropped
+            self.current = None
+        if self.archiver is not None:
+            self.archiver.close()
+            self.archiver = None
+        self.main.close()
+
+
+def open_db(partition=None, **kwargs):
+    """DB, or PartitionedDB when a partition mode is given."""
+    if partition:
+        return PartitionedDB(partition=partition, **kwargs)
+    for key in PARTITION_OPTIONS:
+        if kwargs.pop(key, None) is not None:
+            logger.warning('%s is ignored without partition', key)
+    return DB(**kwargs)
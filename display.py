@@ -1,8 +1,12 @@
+import time
 import curses
+from collections import deque
+
+DISPLAY_FPS = 10.0  # max screen refreshes per second
 
 
 class Display():
-    def __init__(self):
+    def __init__(self, fps=DISPLAY_FPS):
         stdscr = curses.initscr()
 
         curses.curs_set(False)
@@ -29,6 +33,23 @@ class Display():
         self.win_raw = win_raw
         self.win_state = win_state
 
+        # packet lines are collected between frames and drawn at once,
+        # newest first, inside the border
+        self.raw_width = width - 4
+        self.raw_lines = deque(maxlen=height - 2)
+        self.raw_dirty = False
+        self.stat_width = width - 1
+        self.stat_text = {}
+        self.stat_dirty = False
+        self.frame_interval = 1.0 / fps if fps > 0 else 0.0
+        self.frame_time = 0.0
+
+        win_raw.border()
+        win_state.border()
+        win_raw.noutrefresh()
+        win_state.noutrefresh()
+        curses.doupdate()
+
     def quit(self):
         curses.nocbreak()
         self.stdscr.keypad(False)
@@ -36,29 +57,27 @@ class Display():
         curses.endwin()
 
     def print_raw(self, line):
-        self.win_raw.move(1, 2)
-        self.win_raw.insertln()
-        self.win_raw.addstr(1, 2, line)
-
-    def add_stat(self, r, txt):
-        self.win_state.addstr(r, 2, txt)
+        self.raw_lines.appendleft(line)
+        self.raw_dirty = True
+
+    def add_stat(self, r, txt, x=2):
+        # only text that changed is written to the window, the border
+        # is not redrawn, so text stops before it
+        txt = txt[:self.stat_width - x]
+        if self.stat_text.get((r, x)) == txt:
+            return
+        self.stat_text[r, x] = txt
+        self.win_state.addstr(r, x, txt)
+        self.stat_dirty = True
 
     def disp_packet(self, packet):
-        line = ''
-        for c in packet[:-1]:
-            line += f'{c:02X} '
-        c = packet[-1]
-        line += f'{c:02X}'
-        self.print_raw(line)
+        self.print_raw(bytes(packet).hex(' ').upper())
 
     def on_rx_packet(self, packet, ac):
         self.disp_packet(packet)
 
         if ac.params:
-            line = 'Params: '
-            for c in ac.params:
-                line += f' {c:02X}'
-            self.add_stat(3, line)
+            self.add_stat(3, 'Params:  ' + bytes(ac.params).hex(' ').upper())
 
     def disp_state_machine(self, ac):
         line = 'State:   '
@@ -134,13 +153,12 @@ class Display():
 
     def disp_status(self, ac):
         line = 'State1: '
-        for c in ac.state1:
-            line += f' {c:02X}'
+        if ac.state1:
+            line += ' ' + bytes(ac.state1).hex(' ').upper()
         self.add_stat(1, line)
         line = 'State2: '
         if ac.state2:
-            for c in ac.state2:
-                line += f' {c:02X}'
+            line += ' ' + bytes(ac.state2).hex(' ').upper()
         self.add_stat(2, line)
 
         y = 8
@@ -165,35 +183,48 @@ class Display():
         )
 
         txt = 'Ventilation' if ac.vent else ''
-        self.win_state.addstr(9, 47, f'{txt:11s}')
+        self.add_stat(9, f'{txt:11s}', 47)
         txt = 'Humidifier' if ac.humid else ''
-        self.win_state.addstr(10, 47, f'{txt:10s}')
+        self.add_stat(10, f'{txt:10s}', 47)
         txt = 'Filter' if ac.filter else ''
-        self.win_state.addstr(11, 47, f'{txt:6s}')
+        self.add_stat(11, f'{txt:6s}', 47)
         txt = 'Cleaning' if ac.clean else ''
-        self.win_state.addstr(12, 47, f'{txt:8s}')
+        self.add_stat(12, f'{txt:8s}', 47)
 
     def send_status(self, p, status):
         if status == 0:
             line = 'Sent:    '
         else:
             line = 'Failed:  '
-        for a in p:
-            line += f'{a:02X} '
+        line += bytes(p).hex(' ').upper()
         self.add_stat(14, f'{line:55s}')
 
-    def loop(self, ac):
-        self.disp_state_machine(ac)
-
-        self.win_raw.border()
-        self.win_state.border()
-
+    def draw_raw(self):
+        width = self.raw_width
+        for y, line in enumerate(self.raw_lines, 1):
+            self.win_raw.addstr(y, 2, f'{line[:width]:{width}s}')
         self.win_raw.noutrefresh()
-        self.win_state.noutrefresh()
+        self.raw_dirty = False
 
+    def loop(self, ac):
+        # keys are read on every call, the screen at most fps times
+        # a second and only where something changed
+        if self.key_check(ac):
+            return True
+        now = time.monotonic()
+        if now - self.frame_time < self.frame_interval:
+            return False
+        self.disp_state_machine(ac)
+        if not (self.raw_dirty or self.stat_dirty):
+            return False
+        self.frame_time = now
+        if self.raw_dirty:
+            self.draw_raw()
+        if self.stat_dirty:
+            self.win_state.noutrefresh()
+            self.stat_dirty = False
         curses.doupdate()
-
-        return self.key_check(ac)
+        return False
 
     def getch(self):
         c = self.stdscr.getch()
@@ -0,0 +1,132 @@
+"""
+Metrics of the packet processor in the Prometheus text format.
+Counters are plain integers kept by the objects that count, the
+registry reads them through collect functions only when metrics are
+requested, so counting costs one integer increment on the hot path.
+"""
+import json
+import threading
+from bisect import bisect_left
+from logging import getLogger
+
+# seconds, bus round trips are tens of milliseconds, confirmations
+# of a command by the status broadcast take up to a few seconds
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+DB_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25,
+)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+logger = getLogger(__name__)
+
+
+class Histogram():
+    """Cumulative-bucket histogram, observe() is one bisect."""
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """(upper bound, count) pairs, the last bound is '+Inf'."""
+        total = 0
+        result = []
+        for bound, n in zip(self.buckets + ('+Inf',), self.counts):
+            total += n
+            result.append((bound, total))
+        return result
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in labels.items()) + '}'
+
+
+class Registry():
+    """
+    Named metrics with a collect function each. A collect function
+    returns (labels, value) pairs, value is a number for counters and
+    gauges and a Histogram for histograms.
+    """
+
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, name, kind, text, collect):
+        assert kind in ('counter', 'gauge', 'histogram')
+        self.metrics.append((name, kind, text, collect))
+
+    def render(self):
+        lines = []
+        for name, kind, text, collect in self.metrics:
+            lines.append(f'# HELP {name} {text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in collect():
+                if kind != 'histogram':
+                    lines.append(f'{name}{format_labels(labels)} {value}')
+                    continue
+                for bound, n in value.cumulative():
+                    le = dict(labels, le=bound)
+                    lines.append(f'{name}_bucket{format_labels(le)} {n}')
+                lines.append(f'{name}_sum{format_labels(labels)} {value.sum}')
+                lines.append(
+                    f'{name}_count{format_labels(labels)} {value.count}'
+                )
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self):
+        """Metrics as a JSON text, histograms reduced to count and sum."""
+        data = {}
+        for name, kind, _text, collect in self.metrics:
+            for labels, value in collect():
+                key = name + format_labels(labels)
+                if kind == 'histogram':
+                    data[key] = {'count': value.count, 'sum': value.sum}
+                else:
+                    data[key] = value
+        return json.dumps(data)
+
+
+def start_http_server(registry, port, addr='127.0.0.1'):
+    """Serve registry on http://addr:port/metrics from a daemon thread."""
+    # pylint: disable=import-outside-toplevel
+    # http.server and its email imports are only needed with the endpoint
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+
+        def do_GET(self):  # pylint: disable=invalid-name
+            if self.path.split('?')[0] not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        # pylint: disable=redefined-builtin
+        def log_message(self, format, *args):
+            logger.debug(format, *args)
+
+    httpd = ThreadingHTTPServer((addr, port), MetricsHandler)
+    httpd.daemon_threads = True
+    thread = threading.Thread(
+        target=httpd.serve_forever, name='metrics-http', daemon=True
+    )
+    thread.start()
+    logger.info('metrics on http://%s:%d/metrics', addr, port)
+    return httpd
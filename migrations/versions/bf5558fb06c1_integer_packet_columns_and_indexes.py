@@ -0,0 +1,114 @@
+"""Integer packet columns and indexes
+
+Revision ID: bf5558fb06c1
+Revises: 9989da80456c
+Create Date: 2026-10-17 18:19:58.675075
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'bf5558fb06c1'
+down_revision = '9989da80456c'
+branch_labels = None
+depends_on = None
+
+CHUNK_ROWS = 100000
+
+# two hex digits to integer, NULL stays NULL
+HEX_TO_INT = (
+    "((instr('0123456789abcdef', lower(substr({0}, 1, 1))) - 1) * 16"
+    " + instr('0123456789abcdef', lower(substr({0}, 2, 1))) - 1)"
+)
+
+PACKET_HEX_VIEW = """
+CREATE VIEW IF NOT EXISTS packet_hex AS
+SELECT id, time, stat,
+    {txaddr} AS txaddr, {rxaddr} AS rxaddr, {opc1} AS opc1,
+    {mode} AS mode, {opc2} AS opc2,
+    CASE WHEN rawdata IS NOT NULL
+        THEN lower(hex(substr(rawdata, 7, length(rawdata) - 7))) END
+        AS payload,
+    rawdata
+FROM packet
+""".format(**{
+    c: f"CASE WHEN {c} IS NOT NULL THEN printf('%02x', {c}) END"
+    for c in ('txaddr', 'rxaddr', 'opc1', 'mode', 'opc2')
+})
+
+
+def copy_chunks(columns, select):
+    """Copy packet into packet_new in id ranges of CHUNK_ROWS."""
+    conn = op.get_bind()
+    lo, hi = conn.execute(sa.text('SELECT min(id), max(id) FROM packet')).one()
+    if lo is None:
+        return
+    start = lo
+    while start <= hi:
+        conn.execute(sa.text(
+            f'INSERT INTO packet_new ({columns}) SELECT {select} FROM packet'
+            ' WHERE id >= :start AND id < :end'
+        ), {'start': start, 'end': start + CHUNK_ROWS})
+        start += CHUNK_ROWS
+
+
+def upgrade() -> None:
+    op.create_table('packet_new',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('time', sa.DateTime(), nullable=True),
+    sa.Column('stat', sa.String(length=2), nullable=True),
+    sa.Column('txaddr', sa.Integer(), nullable=True),
+    sa.Column('rxaddr', sa.Integer(), nullable=True),
+    sa.Column('opc1', sa.Integer(), nullable=True),
+    sa.Column('mode', sa.Integer(), nullable=True),
+    sa.Column('opc2', sa.Integer(), nullable=True),
+    sa.Column('rawdata', sa.BLOB(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    copy_chunks(
+        'id, time, stat, txaddr, rxaddr, opc1, mode, opc2, rawdata',
+        'id, time, stat, '
+        + ', '.join(
+            HEX_TO_INT.format(c)
+            for c in ('txaddr', 'rxaddr', 'opc1', 'mode', 'opc2')
+        )
+        + ', rawdata'
+    )
+    op.drop_table('packet')
+    op.rename_table('packet_new', 'packet')
+    op.create_index('ix_packet_time', 'packet', ['time'], unique=False)
+    op.create_index('ix_packet_opcode', 'packet', ['opc1', 'opc2', 'time'], unique=False)
+    op.create_index('ix_packet_rxaddr', 'packet', ['rxaddr', 'time'], unique=False)
+    op.execute(PACKET_HEX_VIEW)
+
+
+def downgrade() -> None:
+    op.execute('DROP VIEW IF EXISTS packet_hex')
+    op.create_table('packet_new',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('time', sa.DateTime(), nullable=True),
+    sa.Column('stat', sa.String(length=2), nullable=True),
+    sa.Column('txaddr', sa.String(length=2), nullable=True),
+    sa.Column('rxaddr', sa.String(length=2), nullable=True),
+    sa.Column('opc1', sa.String(length=2), nullable=True),
+    sa.Column('mode', sa.String(length=2), nullable=True),
+    sa.Column('opc2', sa.String(length=2), nullable=True),
+    sa.Column('payload', sa.Text(), nullable=True),
+    sa.Column('rawdata', sa.BLOB(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    copy_chunks(
+        'id, time, stat, txaddr, rxaddr, opc1, mode, opc2, payload, rawdata',
+        'id, time, stat, '
+        + ', '.join(
+            f"CASE WHEN {c} IS NOT NULL THEN printf('%02x', {c}) END"
+            for c in ('txaddr', 'rxaddr', 'opc1', 'mode', 'opc2')
+        )
+        + ', CASE WHEN rawdata IS NOT NULL'
+        ' THEN lower(hex(substr(rawdata, 7, length(rawdata) - 7))) END'
+        ', rawdata'
+    )
+    op.drop_table('packet')
+    op.rename_table('packet_new', 'packet')
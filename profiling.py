@@ -0,0 +1,152 @@
+"""
+Timing hooks for the hot paths of the packet processor.
+Wrapped methods count every call and time one call in sample, the
+report gives call counts, estimated total time and the maximum of the
+sampled calls. SIGUSR1 starts and stops a cProfile of the server
+thread, the result is a .pstats file for pstats, snakeviz or flameprof.
+"""
+import json
+import time
+import signal
+import cProfile
+from functools import wraps
+from logging import getLogger
+
+PROFILE_INTERVAL = 60.0  # seconds between reports
+
+# methods wrapped by Profiler.install() by class name
+HOOKS = {
+    'Server': ('on_message', 'update_status', 'update_sensors'),
+    'AsyncServer': ('on_message', 'update_status', 'update_sensors'),
+    'Aircon': ('parse', 'loop'),
+    'DB': ('write_packet',),
+    'Display': ('loop',),
+}
+
+logger = getLogger(__name__)
+
+
+class FuncStat():
+    __slots__ = ('calls', 'sampled', 'total', 'max')
+
+    def __init__(self):
+        self.calls = 0
+        self.sampled = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def reset(self):
+        self.calls = 0
+        self.sampled = 0
+        self.total = 0.0
+        self.max = 0.0
+
+
+class Profiler():
+    """
+    Wraps methods at class level, so install() must run before the
+    objects are created that hand their bound methods to callbacks.
+    """
+
+    def __init__(self, sample=1, interval=PROFILE_INTERVAL, output=None):
+        self.sample = max(int(sample), 1)
+        self.interval = interval
+        self.output = output
+        self.stats = {}
+        self.report_time = time.monotonic()
+        self.cprofile = None
+
+    def wrap(self, cls, name):
+        func = getattr(cls, name)
+        stat = self.stats[f'{cls.__name__}.{name}'] = FuncStat()
+        sample = self.sample
+        perf_counter = time.perf_counter
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            stat.calls += 1
+            if stat.calls % sample:
+                return func(*args, **kwargs)
+            t0 = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                t = perf_counter() - t0
+                stat.sampled += 1
+                stat.total += t
+                if t > stat.max:
+                    stat.max = t
+
+        wrapper.profiled = func
+        setattr(cls, name, wrapper)
+
+    def install(self, *classes):
+        """Wrap the HOOKS methods of classes, catch SIGUSR1."""
+        for cls in classes:
+            for name in HOOKS.get(cls.__name__, ()):
+                self.wrap(cls, name)
+        if hasattr(signal, 'SIGUSR1'):
+            signal.signal(signal.SIGUSR1, self.toggle_cprofile)
+
+    def report(self, reset=True):
+        """
+        {name: {calls, total, mean, max}} since the last report, times
+        in seconds, total estimated from the sampled calls.
+        """
+        result = {}
+        for name, stat in self.stats.items():
+            if not stat.calls:
+                continue
+            mean = stat.total / stat.sampled if stat.sampled else 0.0
+            result[name] = {
+                'calls': stat.calls, 'total': mean * stat.calls,
+                'mean': mean, 'max': stat.max,
+            }
+            if reset:
+                stat.reset()
+        return result
+
+    def format_report(self, report):
+        lines = [
+            f'{"function":24s} {"calls":>9s} {"total ms":>10s}'
+            f' {"mean us":>9s} {"max ms":>9s}'
+        ]
+        for name, r in sorted(
+                report.items(), key=lambda item: -item[1]['total']):
+            lines.append(
+                f'{name:24s} {r["calls"]:9d} {r["total"] * 1e3:10.1f}'
+                f' {r["mean"] * 1e6:9.1f} {r["max"] * 1e3:9.2f}'
+            )
+        return '\n'.join(lines)
+
+    def dump(self, client=None, topic=None):
+        """
+        Write the report to output, or publish it to topic when no
+        output file is set.
+        """
+        now = time.monotonic()
+        if now - self.report_time < self.interval:
+            return
+        self.report_time = now
+        report = self.report()
+        if not report:
+            return
+        if self.output:
+            with open(self.output, 'a', encoding='utf-8') as f:
+                f.write(time.strftime('%Y-%m-%d %H:%M:%S\n'))
+                f.write(self.format_report(report) + '\n\n')
+        elif client is not None:
+            client.publish(topic, json.dumps(report))
+
+    def toggle_cprofile(self, _signum=None, _frame=None):
+        """Start a cProfile, or stop it and write it to a .pstats file."""
+        if self.cprofile is None:
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+            logger.info('cProfile started')
+            return
+        self.cprofile.disable()
+        path = time.strftime('profile-%Y%m%d-%H%M%S.pstats')
+        self.cprofile.dump_stats(path)
+        self.cprofile = None
+        logger.info('cProfile written to %s', path)
@@ -0,0 +1,301 @@
+"""
+Packet replay for Toshiba air conditioner packet processor.
+Feeds packets recorded in the SQLite packet log through the same
+processing as server.py and writes the messages the server would
+have published as JSON lines.
+"""
+import sys
+import json
+import time
+import argparse
+import configparser
+import datetime as dt
+from collections import namedtuple
+from logging import basicConfig, DEBUG, WARNING
+from server import Server
+from database import DB, PartitionedDB, DB_URL, CHUNK_SIZE, SchemaError
+from toshiba import (
+    PollSchedule, QUERY_SCHEDULE, EXTRA_QUERIES, sensor_value, extra_value
+)
+
+BATCH_GAP = 0.5  # seconds without a query that end a batch or cycle
+SENSOR_QUERIES = [qid for qid in QUERY_SCHEDULE if qid not in EXTRA_QUERIES]
+
+Message = namedtuple('Message', 'topic payload')
+
+
+def query_of(p):
+    """(kind, query id) of a logged query frame, (None, None) otherwise."""
+    if len(p) > 11 and p[2] == 0x17 and p[5] == 0x80 and p[6] == 0xef:
+        return 'sensor', p[11]
+    if len(p) > 9 and p[2] == 0x15 and p[5] == 0xe8:
+        return 'extra', p[9]
+    return None, None
+
+
+def reply_of(p):
+    """Kind of a query reply frame, None for other frames."""
+    if len(p) > 10 and p[4] == 0x80:
+        if p[2] == 0x1a and p[5] == 0xef:
+            return 'sensor'
+        if p[2] == 0x18 and p[5] == 0xe8:
+            return 'extra'
+    return None
+
+
+class QueryLog():
+    """
+    Queries of one kind and unit as the recording server sent them and
+    the replies not matched yet, as (recorded time, value). A TX frame
+    is logged when the broker echoes it, which can be after the reply
+    to it, so a reply may wait for its query as well.
+    """
+
+    def __init__(self):
+        self.qids = []
+        self.replies = []
+        self.sent = None  # recorded time of the last query
+
+
+class ReplayClient():
+    """Stand-in for the paho client, writes publishes to a stream."""
+
+    def __init__(self, out):
+        self.out = out
+        self.time = None
+        self.published = 0
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        if isinstance(payload, (bytes, bytearray)):
+            payload = payload.hex()
+        else:
+            payload = json.loads(payload)
+        record = {
+            'time': self.time.isoformat() if self.time else None,
+            'topic': topic, 'payload': payload,
+        }
+        if retain:
+            record['retain'] = True
+        self.out.write(json.dumps(record) + '\n')
+        self.published += 1
+        return (0, self.published)
+
+
+class ReplayServer(Server):
+
+    def __init__(self, out, topic='aircon', **kwargs):
+        self.out = out
+        config = configparser.ConfigParser()
+        config['broker'] = {'topic': topic}
+        super().__init__(config, **kwargs)
+        self.bridge_alive = True
+        self.queries = {}
+        self.done = {}
+        for unit, ac in self.units.items():
+            # the queries are those of the recording server, taken from
+            # the log, the replay does not poll on its own
+            ac.schedule = PollSchedule({})
+            ac.sensor = dict.fromkeys(SENSOR_QUERIES)
+            for kind in ('sensor', 'extra'):
+                self.queries[unit, kind] = QueryLog()
+            # recorded time the last batch of the unit was answered
+            self.done[unit] = None
+
+    def connect_mqtt(self):
+        return ReplayClient(self.out)
+
+    def replay(self, packets, speed=0.0):
+        """
+        Process (time, stat, rawdata) rows. With speed > 0 the rows are
+        paced at speed times their recorded rate, with speed 0 as fast
+        as possible. Returns the number of rows processed.
+        """
+        t0 = None
+        start = time.monotonic()
+        count = 0
+        for rec_time, stat, rawdata in packets:
+            if speed > 0:
+                if t0 is None:
+                    t0 = rec_time
+                delay = (
+                    (rec_time - t0).total_seconds() / speed
+                    - (time.monotonic() - start)
+                )
+                if delay > 0:
+                    time.sleep(delay)
+            self.publish_updates(rec_time)
+            self.client.time = rec_time
+            if stat == 'RX':
+                msg = Message(f'{self.topic}/packet/rx', rawdata)
+            elif stat == 'TX':
+                msg = Message(f'{self.topic}/packet/tx', rawdata)
+            else:
+                msg = Message(f'{self.topic}/packet/error', stat)
+            self.on_message(self.client, None, msg)
+            if rawdata:
+                if stat == 'TX':
+                    self.follow_query(rec_time, rawdata)
+                elif stat == 'RX':
+                    self.follow_reply(rec_time, rawdata)
+            self.publish_state()
+            for ac in self.units.values():
+                ac.loop()
+            count += 1
+        self.publish_updates(None)
+        return count
+
+    def follow_query(self, rec_time, p):
+        kind, qid = query_of(p)
+        if kind is None or p[1] not in self.units:
+            return
+        log = self.queries[p[1], kind]
+        if qid in log.qids:
+            # a retry sends the whole batch again, the recording server
+            # dropped the replies it had
+            self.drop_batch(log, rec_time)
+        else:
+            self.check_batch(log, rec_time)
+        log.qids.append(qid)
+        log.sent = rec_time
+        # the query cycle goes on, its update comes after the last reply
+        self.done[p[1]] = None
+        self.match(p[1], kind, rec_time)
+
+    def follow_reply(self, rec_time, p):
+        kind = reply_of(p)
+        if kind is None or p[0] not in self.units:
+            return
+        value = sensor_value(p) if kind == 'sensor' else extra_value(p)
+        log = self.queries[p[0], kind]
+        self.check_batch(log, rec_time)
+        log.replies.append((rec_time, value))
+        self.match(p[0], kind, rec_time)
+
+    @staticmethod
+    def check_batch(log, rec_time):
+        """
+        A batch is answered within BATCH_GAP of its last query, later
+        the recording server has resent or given it up.
+        """
+        if (log.sent is not None
+                and (rec_time - log.sent).total_seconds() > BATCH_GAP):
+            ReplayServer.drop_batch(log, rec_time)
+
+    @staticmethod
+    def drop_batch(log, rec_time):
+        # replies just before may answer the queries that follow
+        log.qids = []
+        log.replies = [
+            r for r in log.replies
+            if (rec_time - r[0]).total_seconds() < BATCH_GAP
+        ]
+
+    def match(self, unit, kind, rec_time):
+        """Store the values of a batch once all its replies are in."""
+        log = self.queries[unit, kind]
+        n = len(log.qids)
+        if not n or len(log.replies) < n:
+            return
+        ac = self.units[unit]
+        now = rec_time.timestamp()
+        for qid, (_t, value) in zip(log.qids, log.replies):
+            ac.store_reply(qid, value, now)
+        log.qids = []
+        del log.replies[:n]
+        self.done[unit] = rec_time
+
+    def publish_updates(self, rec_time):
+        """
+        Write the update message of each unit whose query cycle ended,
+        at the time of its last reply. A cycle ends when no query
+        follows within BATCH_GAP of the recorded time, or at the end.
+        """
+        for unit, done in self.done.items():
+            if done is None:
+                continue
+            if (rec_time is not None
+                    and (rec_time - done).total_seconds() < BATCH_GAP):
+                continue
+            self.client.time = done
+            self.update_sensors(self.units[unit])
+            self.done[unit] = None
+
+
+def parse_time(text):
+    return dt.datetime.fromisoformat(text)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='replay logged packets through the packet processor'
+    )
+    parser.add_argument(
+        "-d", "--db", default=DB_URL,
+        help=f"database URL of the packet log, default {DB_URL}"
+    )
+    parser.add_argument(
+        "-P", "--partitioned", action='store_true',
+        help="read the partitions written next to the database"
+    )
+    parser.add_argument(
+        "-s", "--speed", type=float, default=0.0,
+        help="replay speed relative to recording, 0 for as fast as possible"
+    )
+    parser.add_argument(
+        "--start", type=parse_time,
+        help="replay packets logged at or after this ISO time"
+    )
+    parser.add_argument(
+        "--end", type=parse_time,
+        help="replay packets logged before this ISO time"
+    )
+    parser.add_argument(
+        "-c", "--chunk", type=int, default=CHUNK_SIZE,
+        help=f"rows fetched from the database at once, default {CHUNK_SIZE}"
+    )
+    parser.add_argument(
+        "-o", "--output",
+        help="write published messages to file instead of stdout"
+    )
+    parser.add_argument(
+        "-v", "--verbose", action='store_true',
+        help="set logging level to DEBUG"
+    )
+
+    args = parser.parse_args()
+    basicConfig(level=DEBUG if args.verbose else WARNING, stream=sys.stderr)
+
+    if args.output:
+        # pylint: disable=consider-using-with
+        _out = open(args.output, 'w', encoding='utf-8')
+    else:
+        _out = sys.stdout
+
+    try:
+        if args.partitioned:
+            _db = PartitionedDB(args.db)
+        else:
+            _db = DB(args.db)
+    except SchemaError as e:
+        sys.exit(str(e))
+    server = ReplayServer(_out)
+    t_start = time.perf_counter()
+    try:
+        n = server.replay(
+            _db.iter_packets(args.start, args.end, args.chunk), args.speed
+        )
+    finally:
+        _db.close()
+        if _out is not sys.stdout:
+            _out.close()
+    elapsed = time.perf_counter() - t_start
+    print(
+        f'replayed {n} packets in {elapsed:.2f} s '
+        f'({n / elapsed if elapsed else 0:.0f} packets/s), '
+        f'{server.client.published} messages published, '
+        f'{sum(ac.unknown_frames for ac in server.units.values())}'
+        f' unknown frames, '
+        f'{sum(ac.status_suppressed for ac in server.units.values())}'
+        f' unchanged status frames suppressed',
+        file=sys.stderr
+    )
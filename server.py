@@ -3,76 +3,411 @@ Packet processing server for Toshiba air conditioner
 with wired remote controller connected to AB bus.
 This program is for use with toshiba-aircon-mqtt-bridge.
 """
+import os
 import ssl
 import json
 import argparse
 import configparser
 import time
 import sys
+import socket
+import select
+import signal
 import threading
+from functools import partial
 from logging import getLogger, config as logconfig
 from paho.mqtt import client as mqtt_client
-from toshiba import Aircon
+from toshiba import (
+    Aircon, QUERY_SCHEDULE, BITS_TEXT, TEMPERATURE, PRIORITIES
+)
+from metrics import Histogram, Registry, DB_BUCKETS, start_http_server
+
+MISC_INTERVAL = 1.0  # max wait between paho keepalive checks
+DISPLAY_INTERVAL = 0.05  # key polling period in interactive mode
+SNAPSHOT_INTERVAL = 60.0  # seconds between writes of the state snapshot
+SNAPSHOT_MAX_AGE = 300.0  # publish a restored status up to this old
 
 logger = getLogger(__name__)
 lock = threading.Lock()
 
 
+def compile_status_json():
+    """
+    Serialized '"key": value' of every value a status field can take,
+    indexed by the raw field value of the Aircon.
+    """
+    on_off = ((0, 'off'), (1, 'on'))
+    temps = [(t, t) for t in set(TEMPERATURE)] + [(None, None)]
+    fields = (
+        ('power', enumerate(BITS_TEXT['power'])),
+        ('mode', enumerate(BITS_TEXT['mode'])),
+        ('clean', on_off),
+        ('fanlv', enumerate(BITS_TEXT['fan'])),
+        ('settmp', temps),
+        ('temp', temps),
+        ('filter', on_off),
+        ('vent', on_off),
+        ('save', enumerate(BITS_TEXT['save'])),
+        ('humid', enumerate(BITS_TEXT['humid'])),
+    )
+    return {
+        key: {
+            v: sys.intern(f'{json.dumps(key)}: {json.dumps(text)}')
+            for v, text in values
+        }
+        for key, values in fields
+    }
+
+
+STATUS_JSON = compile_status_json()
+
+
+def status_payload(ac):
+    """The status message, the same text json.dumps gives for the dict."""
+    f = STATUS_JSON
+    return '{' + ', '.join((
+        f['power'][ac.power], f['mode'][ac.mode], f['clean'][ac.clean],
+        f['fanlv'][ac.fan_lv], f['settmp'][ac.temp1], f['temp'][ac.temp2],
+        f['filter'][ac.filter], f['vent'][ac.vent], f['save'][ac.save],
+        f['humid'][ac.humid],
+    )) + '}'
+
+
+def update_data(ac):
+    """The update message of the sensor and power values."""
+    return {
+        'pwrlv1': ac.pwr_lv1,
+        'pwrlv2': ac.pwr_lv2,
+        'filter_time': ac.filter_time,
+        'sens_ta': ac.sensor[0x02],
+        'sens_tcj': ac.sensor[0x03],
+        'sens_tc': ac.sensor[0x04],
+        'sens_te': ac.sensor[0x60],
+        'sens_to': ac.sensor[0x61],
+        'sens_td': ac.sensor[0x62],
+        'sens_ts': ac.sensor[0x63],
+        'sens_ths': ac.sensor[0x65],
+        'sens_current': ac.sensor[0x6a],
+    }
+
+
 class Server():
     # pylint: disable=too-many-arguments
     def __init__(
             self, config, disp=None, db=None, statuslog=False,
             packetlog=False, receive_only=True,
-            address=0x42):
+            address=0x42, query_window=1, heartbeat=0.0, telemetry=False,
+            metrics_interval=0.0, profiler=None, snapshot=None):
         self.config = config
         self.bridge_alive = False
-        self.ac = Aircon(address)
         self.disp = disp
         self.db = db
         self.topic = config['broker']['topic']
+        self.unrouted = 0
 
         if db is not None:
             self.statuslog = statuslog
             self.packetlog = packetlog
+            self.telemetry = telemetry
         else:
             self.statuslog = False
             self.packetlog = False
-
-        if not receive_only:
-            self.ac.transmit = self.transmit
-        self.ac.start_cb = self.send_start
-        self.ac.ready_cb = self.send_ready
-        self.ac.state_cb = self.send_state
-        self.ac.update_cb = self.update_sensors
-        self.ac.status_cb = self.update_status
+            self.telemetry = False
+        # last telemetry sample per unit, unchanged values are not
+        # written again
+        self.samples = {}
+
+        # indoor units keyed by their bus address, the source address
+        # of every frame they send
+        self.units = {}
+        self.prefixes = {}
+        self.control_topics = {}
+        schedule = self.load_schedule()
+        units = self.load_units(address)
+        for unit, addr in units.items():
+            ac = Aircon(addr, query_window, schedule, unit, heartbeat)
+            if len(units) > 1:
+                prefix = f'{self.topic}/{unit:02x}'
+            else:
+                prefix = self.topic
+            self.units[unit] = ac
+            self.prefixes[unit] = prefix
+            self.control_topics[f'{prefix}/control'] = ac
+            if not receive_only:
+                ac.transmit = self.transmit
+            ac.start_cb = partial(self.send_start, ac)
+            ac.ready_cb = partial(self.send_ready, ac)
+            ac.state_cb = partial(self.send_state, ac)
+            ac.update_cb = partial(self.update_sensors, ac)
+            ac.status_cb = partial(self.update_status, ac)
+            ac.wakeup_cb = self.wakeup
+        # the interactive display follows the first unit
+        self.ac = next(iter(self.units.values()))
         self.state_queue = []
+        self.wake_r, self.wake_w = socket.socketpair()
+        self.wake_r.setblocking(False)
+        self.wake_w.setblocking(False)
+
+        self.db_latency = {
+            kind: Histogram(DB_BUCKETS)
+            for kind in ('packet', 'status', 'telemetry')
+        }
+        self.metrics_interval = metrics_interval
+        self.metrics_time = time.monotonic()
+        self.profiler = profiler
+        self.registry = self.build_metrics()
+
+        self.snapshot = snapshot
+        self.snapshot_time = time.monotonic()
+        self.provisional = self.load_snapshot() if snapshot else []
 
         self.client = self.connect_mqtt()
 
-    def send_state(self, state):
+    def load_schedule(self):
+        if not self.config.has_section('schedule'):
+            return None
+        schedule = dict(QUERY_SCHEDULE)
+        for qid, bounds in self.config['schedule'].items():
+            min_interval, max_interval = bounds.split(',')
+            schedule[int(qid, 0)] = (
+                float(min_interval), float(max_interval)
+            )
+        return schedule
+
+    def load_units(self, address):
+        """
+        Map of indoor unit address to the address this controller uses
+        towards it, from the [units] section of the configuration.
+        Without entries there, a single unit at 0x00.
+        """
+        if not self.config.has_section('units'):
+            return {0x00: address}
+        units = {
+            int(unit, 0): int(addr, 0)
+            for unit, addr in self.config['units'].items()
+        }
+        return units or {0x00: address}
+
+    def build_metrics(self):
+        """Registry reading the counters of the server and its units."""
+        units = self.units
+        registry = Registry()
+
+        def per_unit(func):
+            return lambda: [
+                ({'unit': f'{u:02x}'}, func(ac)) for u, ac in units.items()
+            ]
+
+        def per_class(func):
+            return lambda: [
+                ({'unit': f'{u:02x}', 'class': name}, func(ac.work, i))
+                for u, ac in units.items()
+                for i, name in enumerate(PRIORITIES)
+            ]
+
+        def rx_frames():
+            return [
+                ({'unit': f'{u:02x}', 'opcode': f'{opcode:02x}'}, n)
+                for u, ac in units.items()
+                for opcode, n in enumerate(ac.rx_frames) if n
+            ]
+
+        for name, kind, text, collect in (
+                ('aircon_rx_frames_total', 'counter',
+                 'Frames received from the unit by opcode', rx_frames),
+                ('aircon_unknown_frames_total', 'counter',
+                 'Received frames without a decoder',
+                 per_unit(lambda ac: ac.unknown_frames)),
+                ('aircon_parse_errors_total', 'counter',
+                 'Received frames that were too short or failed to decode',
+                 per_unit(lambda ac: ac.parse_errors)),
+                ('aircon_tx_frames_total', 'counter',
+                 'Frames sent to the unit',
+                 per_unit(lambda ac: ac.tx_frames)),
+                ('aircon_tx_retries_total', 'counter',
+                 'Frames sent again after a reply timeout',
+                 per_unit(lambda ac: ac.machine.retries)),
+                ('aircon_tx_aborts_total', 'counter',
+                 'Commands and queries given up after retries',
+                 per_unit(lambda ac: ac.machine.aborts)),
+                ('aircon_status_published_total', 'counter',
+                 'Status broadcasts decoded and published',
+                 per_unit(lambda ac: ac.status_emitted)),
+                ('aircon_status_suppressed_total', 'counter',
+                 'Unchanged status broadcasts skipped',
+                 per_unit(lambda ac: ac.status_suppressed)),
+                ('aircon_query_rtt_seconds', 'histogram',
+                 'Time from sending a query to its reply',
+                 per_unit(lambda ac: ac.query_rtt)),
+                ('aircon_command_confirm_seconds', 'histogram',
+                 'Time from starting a command to the status confirming it',
+                 per_unit(lambda ac: ac.cmd_latency)),
+                ('aircon_work_queue_depth', 'gauge',
+                 'Commands and queries waiting for the state machine',
+                 per_class(lambda work, i: work.depth[i])),
+                ('aircon_work_queue_wait_seconds', 'histogram',
+                 'Time from queueing a command or query to its start',
+                 per_class(lambda work, i: work.wait[i])),
+                ('aircon_work_expired_total', 'counter',
+                 'Commands and queries dropped after their deadline',
+                 per_class(lambda work, i: work.expired[i])),
+                ('aircon_work_merged_total', 'counter',
+                 'Commands superseded and duplicate queries dropped',
+                 per_class(lambda work, i: work.merged[i])),
+                ('server_state_queue_depth', 'gauge',
+                 'Processor state messages waiting to be published',
+                 lambda: [({}, len(self.state_queue))]),
+                ('server_unrouted_frames_total', 'counter',
+                 'Received frames from addresses without a unit',
+                 lambda: [({}, self.unrouted)]),
+                ('db_write_seconds', 'histogram',
+                 'Time of a database write on the processing thread',
+                 lambda: [
+                     ({'kind': kind}, h) for kind, h in self.db_latency.items()
+                     if h.count
+                 ]),
+                ('db_dropped_rows_total', 'counter',
+                 'Packet log rows dropped by the buffered writer',
+                 lambda: [({}, self.db.dropped)] if self.db else [])):
+            registry.add(name, kind, text, collect)
+        return registry
+
+    def write_db(self, kind, func, *args):
+        t0 = time.perf_counter()
+        func(*args)
+        self.db_latency[kind].observe(time.perf_counter() - t0)
+
+    def publish_metrics(self):
+        now = time.monotonic()
+        if now - self.metrics_time < self.metrics_interval:
+            return
+        self.metrics_time = now
+        self.client.publish(f'{self.topic}/metrics', self.registry.snapshot())
+
+    def load_snapshot(self):
+        """
+        Restore the units from the snapshot file, return the units
+        whose snapshot is recent enough to publish as their status.
+        """
+        try:
+            with open(self.snapshot, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return []
+        except (OSError, ValueError) as e:
+            logger.error('snapshot %s not loaded: %s', self.snapshot, e)
+            return []
+        age = time.time() - data.get('time', 0.0)
+        restored = []
+        for unit, ac in self.units.items():
+            unit_data = data.get('units', {}).get(f'{unit:02x}')
+            if unit_data is None:
+                continue
+            try:
+                ac.restore(unit_data)
+            except (KeyError, TypeError, ValueError) as e:
+                logger.error('snapshot of unit %02x not loaded: %s', unit, e)
+                continue
+            if age <= SNAPSHOT_MAX_AGE:
+                restored.append(ac)
+        logger.info(
+            'snapshot %s loaded, %.0f seconds old', self.snapshot, age
+        )
+        return restored
+
+    def save_snapshot(self, force=False):
+        now = time.monotonic()
+        if not force and now - self.snapshot_time < SNAPSHOT_INTERVAL:
+            return
+        self.snapshot_time = now
+        data = {
+            'time': time.time(),
+            'units': {
+                f'{unit:02x}': ac.snapshot()
+                for unit, ac in self.units.items()
+            },
+        }
+        # a crash while writing leaves the previous snapshot in place
+        tmp = self.snapshot + '.tmp'
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(tmp, self.snapshot)
+        except OSError as e:
+            logger.error('snapshot %s not saved: %s', self.snapshot, e)
+
+    def publish_provisional(self):
+        """
+        Publish the restored status and update messages of a snapshot
+        until the unit broadcasts its status again.
+        """
+        for ac in self.provisional:
+            prefix = self.prefixes[ac.unit]
+            if ac.power is not None:
+                self.client.publish(f'{prefix}/status', status_payload(ac))
+            try:
+                data = update_data(ac)
+            except KeyError:
+                continue
+            self.client.publish(f'{prefix}/update', json.dumps(data))
+        self.provisional = []
+
+    def wakeup(self):
+        # may be called from state machine timer threads
+        try:
+            self.wake_w.send(b'\0')
+        except BlockingIOError:
+            pass
+
+    def send_state(self, ac, state):
+        topic = f'{self.prefixes[ac.unit]}/client/processor'
         payload = json.dumps({'internal_state': state})
         with lock:
-            self.state_queue.append((payload, False))
+            self.state_queue.append((topic, payload, False))
+        self.wakeup()
 
-    def send_start(self):
+    def send_start(self, ac):
+        topic = f'{self.prefixes[ac.unit]}/client/processor'
         payload = json.dumps({'state': 'start'})
         with lock:
-            self.state_queue.append((payload, True))
+            self.state_queue.append((topic, payload, True))
+        self.wakeup()
 
-    def send_ready(self):
+    def send_ready(self, ac):
+        topic = f'{self.prefixes[ac.unit]}/client/processor'
         payload = json.dumps({'state': 'ready'})
         with lock:
-            self.state_queue.append((payload, True))
+            self.state_queue.append((topic, payload, True))
+        self.wakeup()
+
+    def publish_offline(self):
+        """
+        Offline state on the client/processor topic of the server and
+        of every unit, for a clean shutdown. The last will is only set
+        for the topic of the server.
+        """
+        payload = json.dumps({'state': 'offline'})
+        topics = [f'{self.topic}/client/processor'] + [
+            f'{prefix}/client/processor'
+            for prefix in self.prefixes.values() if prefix != self.topic
+        ]
+        for topic in topics:
+            self.client.publish(topic, payload, qos=1, retain=True)
+        self.client.disconnect()
 
     def on_connect(self, _client, _userdata, _flags, rc):
         logger.info("Connected to MQTT broker with status %d", rc)
         if rc == 0:
             self.client.subscribe(f'{self.topic}/#', qos=1)
+            self.publish_provisional()
         else:
             logger.error('MQTT connection failed, abort')
             sys.exit(1)
 
-    def on_disconnect(self, _client, _userdata, _rc):
+    def on_disconnect(self, _client, _userdata, rc):
+        if rc == mqtt_client.MQTT_ERR_SUCCESS:
+            # disconnect() of publish_offline
+            return
         logger.warning("MQTT disconnected")
         while True:
             logger.debug("Trying to reconnect")
@@ -84,27 +419,31 @@ class Server():
                 time.sleep(5)
 
     def on_message(self, _client, _userdata, msg):
-        ac = self.ac
         # pylint: disable=too-many-branches
         if msg.topic == f'{self.topic}/packet/rx':
             packet = msg.payload
             logger.debug(f'{msg.topic}: %s', bytes(packet).hex())
-            ac.parse(packet)
+            ac = self.units.get(packet[0]) if packet else None
+            if ac is not None:
+                ac.parse(packet)
+            else:
+                self.unrouted += 1
             if self.packetlog:
-                self.db.write_packet('RX', packet)
+                self.write_db('packet', self.db.write_packet, 'RX', packet)
             if self.disp:
-                self.disp.on_rx_packet(packet, ac)
+                self.disp.on_rx_packet(packet, self.ac)
         elif msg.topic == f'{self.topic}/packet/tx':
             packet = msg.payload
             logger.debug(f'{msg.topic}: %s', bytes(packet).hex())
             if self.packetlog:
-                self.db.write_packet('TX', packet)
+                self.write_db('packet', self.db.write_packet, 'TX', packet)
         elif msg.topic == f'{self.topic}/packet/error':
             status = msg.payload
             logger.info(f'{msg.topic}: %s', status)
             if self.packetlog:
-                self.db.write_packet(status)
-        elif msg.topic == f'{self.topic}/control':
+                self.write_db('packet', self.db.write_packet, status)
+        elif msg.topic in self.control_topics:
+            ac = self.control_topics[msg.topic]
             if not self.bridge_alive:
                 return
             try:
@@ -134,10 +473,12 @@ class Server():
                 logger.info(f'{msg.topic}: %s', data)
                 connection = data.get('connection')
                 if connection == 'dead':
-                    ac.reset()
+                    for ac in self.units.values():
+                        ac.reset()
                     self.bridge_alive = False
                 elif connection == 'alive':
-                    ac.reset()
+                    for ac in self.units.values():
+                        ac.reset()
                     self.bridge_alive = True
 
         elif msg.topic == f'{self.topic}/update':
@@ -182,16 +523,16 @@ class Server():
         return client
 
     def transmit(self, p):
-        result = self.client.publish(f'{self.topic}/packet/tx', bytearray(p))
+        result = self.client.publish(f'{self.topic}/packet/tx', p)
         logger.debug('packet sent: %s', result)
         status = result[0]
         if self.disp:
             self.disp.disp_packet(p)
             self.disp.send_status(p, status)
 
-    def update_sensors(self):
-        ac = self.ac
-        if self.disp:
+    def update_sensors(self, ac):
+        prefix = self.prefixes[ac.unit]
+        if self.disp and ac is self.ac:
             self.disp.disp_sensors(ac)
         update = {
             'power': ac.bits_to_text('power', ac.power),
@@ -217,58 +558,102 @@ class Server():
             'humid': ac.bits_to_text('humid', ac.humid),
         }
         if self.statuslog:
-            self.db.write_status(update)
-        data = {
-            'pwrlv1': ac.pwr_lv1,
-            'pwrlv2': ac.pwr_lv2,
-            'filter_time': ac.filter_time,
-            'sens_ta': ac.sensor[0x02],
-            'sens_tcj': ac.sensor[0x03],
-            'sens_tc': ac.sensor[0x04],
-            'sens_te': ac.sensor[0x60],
-            'sens_to': ac.sensor[0x61],
-            'sens_td': ac.sensor[0x62],
-            'sens_ts': ac.sensor[0x63],
-            'sens_ths': ac.sensor[0x65],
-            'sens_current': ac.sensor[0x6a],
-        }
-        result = self.client.publish(f'{self.topic}/update', json.dumps(data))
+            if len(self.units) > 1:
+                update['unit'] = ac.unit
+            self.write_db('status', self.db.write_status, update)
+        data = update_data(ac)
+        if self.telemetry:
+            last = self.samples.setdefault(ac.unit, {})
+            sample = {
+                key: value
+                for key, value in dict(
+                    data, settmp=ac.temp1, temp=ac.temp2
+                ).items()
+                if last.get(key) != value
+            }
+            if sample:
+                last.update(sample)
+                self.write_db(
+                    'telemetry', self.db.write_telemetry, ac.unit, sample
+                )
+        result = self.client.publish(f'{prefix}/update', json.dumps(data))
         logger.debug('update sent: %s', result)
 
-    def update_status(self, ext):
-        ac = self.ac
-        if self.disp:
+    def update_status(self, ac, ext):
+        prefix = self.prefixes[ac.unit]
+        if self.disp and ac is self.ac:
             self.disp.disp_status(ac)
-        data = {
-            'power': ac.bits_to_text('power', ac.power),
-            'mode': ac.bits_to_text('mode', ac.mode),
-            'clean': 'on' if ac.clean == 1 else 'off',
-            'fanlv': ac.bits_to_text('fan', ac.fan_lv),
-            'settmp': ac.temp1,
-            'temp': ac.temp2,
-            'filter': 'on' if ac.filter == 1 else 'off',
-            'vent': 'on' if ac.vent == 1 else 'off',
-            'save': ac.bits_to_text('save', ac.save),
-            'humid': ac.bits_to_text('humid', ac.humid),
-        }
-        result = self.client.publish(f'{self.topic}/status', json.dumps(data))
+        data = status_payload(ac)
+        result = self.client.publish(f'{prefix}/status', data)
 
         if not ext:
             logger.info('status change: %s', data)
         logger.debug('status sent: %s, result:%s', data, result)
 
+    def publish_state(self):
+        with lock:
+            while self.state_queue:
+                topic, payload, retain = self.state_queue.pop(0)
+                self.client.publish(
+                    topic, payload=payload, qos=1, retain=retain
+                )
+
+    def wait(self):
+        """
+        Sleep until the MQTT socket is ready, the state machine wakes
+        us up or the aircon has timed work due, then run paho's
+        network functions for whatever became ready.
+        """
+        client = self.client
+        sock = client.socket()
+        timeout = MISC_INTERVAL
+        for ac in self.units.values():
+            t = ac.next_timeout()
+            if t is not None and t < timeout:
+                timeout = t
+        if self.disp and timeout > DISPLAY_INTERVAL:
+            timeout = DISPLAY_INTERVAL
+        rlist = [self.wake_r]
+        wlist = []
+        buffered = False
+        if sock is not None:
+            rlist.append(sock)
+            if client.want_write():
+                wlist.append(sock)
+            pending = getattr(sock, 'pending', None)
+            if pending is not None and pending() > 0:
+                # TLS data already decrypted and buffered by ssl
+                buffered = True
+                timeout = 0.0
+        try:
+            readable, writable, _ = select.select(rlist, wlist, [], timeout)
+        except (OSError, ValueError):
+            # socket closed under us, let loop_misc deal with it
+            readable, writable = [], []
+        if self.wake_r in readable:
+            try:
+                while self.wake_r.recv(4096):
+                    pass
+            except BlockingIOError:
+                pass
+        if sock is not None and (sock in readable or buffered):
+            client.loop_read()
+        if sock is not None and sock in writable:
+            client.loop_write()
+        client.loop_misc()
+
     def run(self):
         while True:
-            with lock:
-                while self.state_queue:
-                    payload, retain = self.state_queue.pop(0)
-                    self.client.publish(
-                        f'{self.topic}/client/processor',
-                        payload=payload, qos=1, retain=retain
-                    )
-
-            self.client.loop(timeout=0.01)
-            self.ac.loop()
+            self.publish_state()
+            self.wait()
+            for ac in self.units.values():
+                ac.loop()
+            if self.metrics_interval:
+                self.publish_metrics()
+            if self.profiler is not None:
+                self.profiler.dump(self.client, f'{self.topic}/profile')
+            if self.snapshot:
+                self.save_snapshot()
             if self.disp:
                 if self.disp.loop(self.ac):
                     break
@@ -282,18 +667,66 @@ if __name__ == '__main__':
         "-i", "--interactive", action='store_true',
         help="enable interactive mode"
     )
+    parser.add_argument(
+        "--fps", type=float, default=10.0, metavar='N',
+        help="max screen refreshes per second in interactive mode"
+    )
     parser.add_argument(
         "-p", "--packetlog", action='store_true',
         help="enable packet logging to database"
     )
+    parser.add_argument(
+        "-b", "--buffered", action='store_true',
+        help="write packet log in batches from a background thread"
+    )
     parser.add_argument(
         "-s", "--statuslog", action='store_true',
         help="enable status logging to database"
     )
+    parser.add_argument(
+        "-t", "--telemetry", action='store_true',
+        help="enable compact sensor history in the database"
+    )
     parser.add_argument(
         "-r", "--receive-only", action='store_true',
         help="disable packet transmission"
     )
+    parser.add_argument(
+        "-w", "--query-window", type=int, default=1, metavar='N',
+        help="max number of sensor queries in flight, default 1"
+    )
+    parser.add_argument(
+        "--heartbeat", type=float, default=0.0, metavar='SECONDS',
+        help="republish an unchanged status after SECONDS, default never"
+    )
+    parser.add_argument(
+        "--metrics-port", type=int, default=0, metavar='PORT',
+        help="serve metrics on http://127.0.0.1:PORT/metrics"
+    )
+    parser.add_argument(
+        "--metrics-interval", type=float, default=0.0, metavar='SECONDS',
+        help="publish metrics to <topic>/metrics every SECONDS"
+    )
+    parser.add_argument(
+        "--profile", type=int, nargs='?', const=1, default=0, metavar='N',
+        help="time one in N calls of the hot paths, default every call"
+    )
+    parser.add_argument(
+        "--profile-interval", type=float, default=60.0, metavar='SECONDS',
+        help="report interval of --profile, default 60"
+    )
+    parser.add_argument(
+        "--profile-output", metavar='FILE',
+        help="append --profile reports to FILE instead of <topic>/profile"
+    )
+    parser.add_argument(
+        "--asyncio", action='store_true',
+        help="run the server on an asyncio event loop"
+    )
+    parser.add_argument(
+        "--snapshot", metavar='FILE',
+        help="keep the last unit state in FILE and restore it at start"
+    )
     parser.add_argument(
         "-v", "--verbose", action='store_true',
         help="set logging level to DEBUG"
@@ -334,17 +767,66 @@ if __name__ == '__main__':
 
     if args.interactive:
         from display import Display
-        _disp = Display()
+        _disp = Display(args.fps)
     else:
         _disp = None
 
-    if args.packetlog or args.statuslog:
-        from database import DB
-        _db = DB()
+    if args.packetlog or args.statuslog or args.telemetry:
+        from database import open_db, load_options, SchemaError
+        try:
+            _db = open_db(buffered=args.buffered, **load_options(config))
+        except SchemaError as e:
+            logger.error('%s', e)
+            sys.exit(1)
     else:
         _db = None
 
-    server = Server(
-        config, _disp, _db, args.statuslog, args.packetlog, args.receive_only
+    if args.asyncio:
+        from aioserver import AsyncServer as server_class
+    else:
+        server_class = Server
+
+    if args.profile:
+        from profiling import Profiler
+        _profiler = Profiler(
+            args.profile, args.profile_interval, args.profile_output
+        )
+        # before Server() hands its bound methods to paho and the units
+        _profiler.install(server_class, Aircon)
+        if _disp is not None:
+            _profiler.install(Display)
+        if _db is not None:
+            # PartitionedDB writes through DB as well
+            from database import DB
+            _profiler.install(DB)
+    else:
+        _profiler = None
+
+    server = server_class(
+        config, _disp, _db, args.statuslog, args.packetlog, args.receive_only,
+        query_window=args.query_window, heartbeat=args.heartbeat,
+        telemetry=args.telemetry, metrics_interval=args.metrics_interval,
+        profiler=_profiler, snapshot=args.snapshot
     )
-    server.run()
+    # run the finally clause below on a service stop as well, it saves
+    # the snapshot and flushes the rows the packet writer still holds
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    if args.metrics_port:
+        _httpd = start_http_server(server.registry, args.metrics_port)
+    else:
+        _httpd = None
+    try:
+        server.run()
+    finally:
+        if args.snapshot:
+            server.save_snapshot(force=True)
+        server.publish_offline()
+        for _ac in server.units.values():
+            logger.info(
+                'unit %02x status: %d published, %d unchanged suppressed',
+                _ac.unit, _ac.status_emitted, _ac.status_suppressed
+            )
+        if _httpd is not None:
+            _httpd.shutdown()
+        if _db is not None:
+            _db.close()
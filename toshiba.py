@@ -8,18 +8,57 @@ Tested with NTS-F1403Y1 indoor unit (residential central AC).
 
 """
 from enum import IntEnum
-from collections import namedtuple
+from collections import namedtuple, deque
+import sys
 import time
 import struct
 import threading
+from functools import partialmethod
 from logging import getLogger
-from transitions import Machine
-# from transitions.extensions import GraphMachine as Machine
-from transitions.extensions.states import add_state_features, Timeout
+from metrics import Histogram
 
 RETRY_WAIT = 1.0  # timeout in seconds for command or query reply
 WSTAT_WAIT = 2.0
-QUERY_INTERVAL = 60.0
+QUERY_INTERVAL = 60.0  # initial polling interval of each query
+QUERY_WINDOW = 1  # max number of queries in flight
+BACKOFF = 1.5  # interval growth factor while a polled value is stable
+STATUS_HEARTBEAT = 0.0  # republish an unchanged status after seconds, 0: never
+COMMAND_TTL = 30.0  # a control command waiting longer is dropped
+
+# work queue priority classes, lower runs first
+CONTROL, CONFIRM, QUERY = range(3)
+PRIORITIES = ('control', 'confirm', 'query')
+
+# polling interval bounds in seconds per query id
+QUERY_SCHEDULE = {
+    0x94: (15.0, 240.0),  # power level
+    0x9e: (600.0, 3600.0),  # filter time
+    0x02: (30.0, 300.0),  # TA
+    0x03: (30.0, 300.0),  # TCJ
+    0x04: (30.0, 300.0),  # TC
+    0x60: (30.0, 300.0),  # TE
+    0x61: (30.0, 300.0),  # TO
+    0x62: (30.0, 300.0),  # TD
+    0x63: (30.0, 300.0),  # TS
+    0x65: (30.0, 300.0),  # THS
+    0x6a: (10.0, 120.0),  # compressor current
+}
+EXTRA_QUERIES = (0x94, 0x9e)
+
+SENSOR_VALUE = struct.Struct('>h')
+EXTRA_VALUE = struct.Struct('>H')
+
+# status frame fields indexed by raw byte value
+STATUS_B0 = tuple(  # power, mode, save
+    (b & 0b1, (b >> 5) & 0b111, (b >> 3) & 0b11) for b in range(256)
+)
+STATUS_B1 = tuple(  # clean, fan_lv
+    ((b >> 2) & 0b1, (b >> 5) & 0b111) for b in range(256)
+)
+STATUS_B2 = tuple(  # filter, vent, humid
+    ((b >> 7) & 0b1, (b >> 2) & 0b1, (b >> 1) & 0b1) for b in range(256)
+)
+TEMPERATURE = tuple((b >> 1) - 35 for b in range(256))
 
 logger = getLogger(__name__)
 lock = threading.Lock()
@@ -61,135 +100,191 @@ class State(IntEnum):
         return text
 
 
-@add_state_features(Timeout)
-class CustomMachine(Machine):
+# states the frame decoders test, looking a member up on the enum class
+# costs several times more than a global
+START, CMD, QUERY1, QUERY2, HMDTGL = (
+    State.START, State.CMD, State.QUERY1, State.QUERY2, State.HMDTGL
+)
+
+
+class MachineError(Exception):
     pass
 
 
-states = [
-    {
-        'name': State.START,
-        'on_enter': 'start_enter', 'on_exit': 'start_exit'
-    },
-    State.IDLE,
-    {
-        'name': State.CMD, 'timeout': RETRY_WAIT,
-        'on_timeout': 'send_timeout', 'on_exit': 'send_exit'
-    },
-    {
-        'name': State.WSTAT, 'timeout': WSTAT_WAIT,
-        'on_timeout': 'wstat_timeout', 'on_exit': 'wstat_exit'
-    },
-    {
-        'name': State.QUERY1, 'timeout': RETRY_WAIT,
-        'on_timeout': 'send_timeout', 'on_exit': 'send_exit'
-    },
-    {
-        'name': State.QUERY2, 'timeout': RETRY_WAIT,
-        'on_timeout': 'send_timeout', 'on_exit': 'send_exit'
-    },
-    {
-        'name': State.SSAVE, 'timeout': RETRY_WAIT,
-        'on_timeout': 'send_timeout', 'on_exit': 'send_exit'
-    },
-    {
-        'name': State.FILTER, 'timeout': RETRY_WAIT,
-        'on_timeout': 'send_timeout', 'on_exit': 'send_exit'
-    },
-    {
-        'name': State.HUMID, 'timeout': RETRY_WAIT,
-        'on_timeout': 'hmd_timeout', 'on_exit': 'hmd_exit'
-    },
-    {
-        'name': State.HMDTGL, 'timeout': RETRY_WAIT,
-        'on_timeout': 'send_timeout', 'on_exit': 'send_exit'
-    },
-]
+def sensor_value(p):
+    """Value of a sensor query reply, None if the unit reports none."""
+    if p[8] == 0x2c:
+        return SENSOR_VALUE.unpack_from(p, 9)[0]
+    return None
+
+
+def extra_value(p):
+    """Data bytes of an extra query reply."""
+    return p[6:11]
+
+
+# Transition table: trigger -> (source states, destination, after, unless).
+# Destination None is a reflexive transition, the state is exited and
+# entered again, which restarts its timeout.
+TRANSITIONS = {
+    'reset': (tuple(State), State.START, None, None),
+    'idle': (
+        (State.START, State.CMD, State.WSTAT, State.QUERY1,
+         State.QUERY2, State.SSAVE, State.FILTER, State.HUMID),
+        State.IDLE, None, None
+    ),
+    'cmd': ((State.IDLE, State.WSTAT), State.CMD, 'send_packet', 'rx_only'),
+    'wstat': ((State.CMD,), State.WSTAT, None, None),
+    'query1': ((State.IDLE,), State.QUERY1, 'send_packet', 'rx_only'),
+    'query2': ((State.IDLE,), State.QUERY2, 'send_packet', 'rx_only'),
+    'ssave': ((State.IDLE,), State.SSAVE, 'send_packet', 'rx_only'),
+    'filter': ((State.IDLE,), State.FILTER, 'send_packet', 'rx_only'),
+    'humid': (
+        (State.IDLE, State.HMDTGL), State.HUMID, 'set_humid', 'rx_only'
+    ),
+    'hmdtgl': ((State.HUMID,), State.HMDTGL, 'send_packet', 'rx_only'),
+    'self': (
+        (State.CMD, State.QUERY1, State.QUERY2,
+         State.SSAVE, State.FILTER, State.HMDTGL),
+        None, None, None
+    ),
+}
+
+# state -> (timeout, on_timeout)
+TIMEOUTS = {
+    State.CMD: (RETRY_WAIT, 'send_timeout'),
+    State.WSTAT: (WSTAT_WAIT, 'wstat_timeout'),
+    State.QUERY1: (RETRY_WAIT, 'send_timeout'),
+    State.QUERY2: (RETRY_WAIT, 'send_timeout'),
+    State.SSAVE: (RETRY_WAIT, 'send_timeout'),
+    State.FILTER: (RETRY_WAIT, 'send_timeout'),
+    State.HUMID: (RETRY_WAIT, 'hmd_timeout'),
+    State.HMDTGL: (RETRY_WAIT, 'send_timeout'),
+}
+ON_ENTER = {
+    State.START: 'start_enter',
+}
+ON_EXIT = {
+    State.START: 'start_exit',
+    State.CMD: 'send_exit',
+    State.WSTAT: 'wstat_exit',
+    State.QUERY1: 'send_exit',
+    State.QUERY2: 'send_exit',
+    State.SSAVE: 'send_exit',
+    State.FILTER: 'send_exit',
+    State.HUMID: 'hmd_exit',
+    State.HMDTGL: 'send_exit',
+}
+# state -> Aircon method telling whether the decoded status confirms
+# the command the state waits for
+CONFIRMS = {
+    State.WSTAT: 'wstat_confirmed',
+    State.SSAVE: 'ssave_confirmed',
+    State.FILTER: 'filter_confirmed',
+    State.HUMID: 'humid_confirmed',
+}
+
+Event = namedtuple('Event', 'source dest kwargs')
+Transition = namedtuple('Transition', 'dests after unless')
+
+
+def compile_transitions():
+    """Destination per source state, indexed by State value."""
+    table = {}
+    for trigger, (sources, dest, after, unless) in TRANSITIONS.items():
+        dests = [False] * len(State)
+        for source in sources:
+            dests[source] = source if dest is None else dest
+        table[trigger] = Transition(tuple(dests), after, unless)
+    return table
+
+
+TRANSITION_TABLE = compile_transitions()
 
 
 class StateMachine(object):
+    """
+    State machine of the command and query sequences.
+    Timeouts are not run on timer threads, the owner calls
+    check_timeout() from its loop and can sleep until deadline.
+    """
 
     def __init__(self, ac):
         self.ac = ac
         self.callback = None
         self.hmd = None
         self.retry = 0
-
-        self.machine = CustomMachine(
-            model=self, states=states, initial=State.START,
-            auto_transitions=False, send_event=True,
-            before_state_change='state_change'
-        )
-        self.machine.add_transition(
-            trigger='reset',
-            source='*',
-            dest=State.START,
-        )
-        self.machine.add_transition(
-            trigger='idle',
-            source=[
-                State.START, State.CMD, State.WSTAT, State.QUERY1,
-                State.QUERY2, State.SSAVE, State.FILTER, State.HUMID
-            ],
-            dest=State.IDLE,
-        )
-        self.machine.add_transition(
-            trigger='cmd',
-            source=[State.IDLE, State.WSTAT],
-            dest=State.CMD,
-            after='send_packet', unless='rx_only'
-        )
-        self.machine.add_transition(
-            trigger='wstat', source=State.CMD, dest=State.WSTAT,
-        )
-        self.machine.add_transition(
-            trigger='query1', source=State.IDLE, dest=State.QUERY1,
-            after='send_packet', unless='rx_only'
-        )
-        self.machine.add_transition(
-            trigger='query2', source=State.IDLE, dest=State.QUERY2,
-            after='send_packet', unless='rx_only'
-        )
-        self.machine.add_transition(
-            trigger='ssave', source=State.IDLE, dest=State.SSAVE,
-            after='send_packet', unless='rx_only'
-        )
-        self.machine.add_transition(
-            trigger='filter', source=State.IDLE, dest=State.FILTER,
-            after='send_packet', unless='rx_only'
-        )
-        self.machine.add_transition(
-            trigger='humid',
-            source=[State.IDLE, State.HMDTGL], dest=State.HUMID,
-            after='set_humid', unless='rx_only'
-        )
-        self.machine.add_transition(
-            trigger='hmdtgl', source=State.HUMID, dest=State.HMDTGL,
-            after='send_packet', unless='rx_only'
-        )
-        self.machine.add_transition(
-            trigger='self',
-            source=[
-                State.CMD, State.QUERY1, State.QUERY2,
-                State.SSAVE, State.FILTER, State.HMDTGL
-            ],
-            dest='=',
-        )
+        self.retries = 0
+        self.aborts = 0
+        self.state = State.START
+        self.deadline = None
+        self.timeout_event = None
+
+    def trigger(self, name, **kwargs):
+        transition = TRANSITION_TABLE[name]
+        source = self.state
+        dest = transition.dests[source]
+        if dest is False:
+            raise MachineError(
+                f"Can't trigger event {name} from state {source.name}!"
+            )
+        if transition.unless is not None:
+            if getattr(self, transition.unless)():
+                return False
+        event = Event(source, dest, kwargs)
+        self.state_change(event)
+        self.deadline = None
+        if source in ON_EXIT:
+            getattr(self, ON_EXIT[source])(event)
+        self.state = dest
+        if dest in TIMEOUTS:
+            self.deadline = time.monotonic() + TIMEOUTS[dest][0]
+            self.timeout_event = event
+        if dest in ON_ENTER:
+            getattr(self, ON_ENTER[dest])(event)
+        if transition.after is not None:
+            getattr(self, transition.after)(event)
+        if self.state in CONFIRMS:
+            # the status may already show the result
+            self.ac.confirm()
+        return True
+
+    reset = partialmethod(trigger, 'reset')
+    idle = partialmethod(trigger, 'idle')
+    cmd = partialmethod(trigger, 'cmd')
+    wstat = partialmethod(trigger, 'wstat')
+    query1 = partialmethod(trigger, 'query1')
+    query2 = partialmethod(trigger, 'query2')
+    ssave = partialmethod(trigger, 'ssave')
+    filter = partialmethod(trigger, 'filter')
+    humid = partialmethod(trigger, 'humid')
+    hmdtgl = partialmethod(trigger, 'hmdtgl')
+    self = partialmethod(trigger, 'self')
+
+    def check_timeout(self, now):
+        if self.deadline is None or now < self.deadline:
+            return
+        self.deadline = None
+        try:
+            getattr(self, TIMEOUTS[self.state][1])(self.timeout_event)
+        except Exception as e:
+            logger.error('state machine timeout handling failed: %s', e)
 
     def state_change(self, event):
         if callable(self.ac.state_cb):
-            self.ac.state_cb(str(event.transition.dest).lower())
+            self.ac.state_cb(event.dest.name.lower())
+        self.ac.wakeup()
 
     def start_enter(self, _event):
         if callable(self.ac.start_cb):
             self.ac.start_cb()
 
     def start_exit(self, event):
-        if event.transition.dest != event.transition.source:
+        if event.dest != event.source:
             if callable(self.ac.ready_cb):
                 self.ac.ready_cb()
 
-    def rx_only(self, _event):
+    def rx_only(self):
         return self.ac.transmit is None
 
     def send_packet(self, event):
@@ -197,49 +292,45 @@ class StateMachine(object):
         self.retry = 0
         callback = event.kwargs.get('callback')
         if callback is not None:
-            self.callback = event.kwargs.get('callback')
+            self.callback = callback
         func, args = self.callback
         try:
             func(*args)
         except Exception as e:
             logger.error('state machine packet send failed: %s', e)
-            # pylint: disable=no-member
             self.idle()
 
     def send_timeout(self, _event):
         self.retry += 1
+        self.retries += 1
         if self.retry < 2:
             logger.debug('send_timeout retry: %d', self.retry)
         elif self.retry < 5:
             logger.warning('send_timeout retry: %d', self.retry)
         else:
             logger.error('send_timeout retry: %d, abort', self.retry)
-            # pylint: disable=no-member
+            self.aborts += 1
             self.idle()
             return
         func, args = self.callback
         func(*args)
-        # pylint: disable=no-member
         self.self()
 
     def send_exit(self, event):
-        if (event.transition.dest != event.transition.source
-                and event.transition.dest != State.WSTAT.name):
+        if event.dest != event.source and event.dest != State.WSTAT:
             self.callback = None
 
     def wstat_timeout(self, _event):
-        # pylint: disable=no-member
         self.cmd()
 
     def wstat_exit(self, event):
-        if event.transition.dest != State.CMD.name:
+        if event.dest != State.CMD:
             self.callback = None
 
     def set_humid(self, event):
         hmd = event.kwargs.get('value')
         if hmd is not None:
             if self.ac.humid == hmd:
-                # pylint: disable=no-member
                 self.idle()
             else:
                 self.hmd = hmd
@@ -249,7 +340,7 @@ class StateMachine(object):
         self.ac.toggle_humid()
 
     def hmd_exit(self, event):
-        if event.transition.dest != State.HMDTGL.name:
+        if event.dest != State.HMDTGL:
             self.hmd = None
 
 
@@ -289,31 +380,278 @@ CMDSETS = CommandSets(
     )
 )
 
+
+def compile_cmdsets():
+    """
+    Per command type, the text of every bit pattern the status field
+    can hold, indexed by the bits, and a map of command to bits.
+    Patterns without an entry in CMDSETS read as the binary number.
+    """
+    texts = {}
+    bits = {}
+    for cmdtype, items in CMDSETS._asdict().items():
+        width = max(csi.bits for csi in items).bit_length()
+        table = [sys.intern(f'{b:b}') for b in range(1 << width)]
+        cmds = {}
+        # first entry wins like the scan over CMDSETS did
+        for csi in reversed(items):
+            table[csi.bits] = sys.intern(csi.text)
+            if csi.cmd:
+                cmds[csi.cmd] = csi.bits
+        texts[cmdtype] = tuple(table)
+        bits[cmdtype] = cmds
+    return texts, bits
+
+
+BITS_TEXT, CMD_BITS = compile_cmdsets()
+
 CmdSetting = namedtuple('CmdSetting', 'var value')
 
 
+class PacketTemplate():
+    """
+    TX frame with a fixed head and nvar variable bytes before the
+    checksum. The head and its checksum are computed once, build()
+    patches the variable bytes and folds them into the checksum.
+    """
+    __slots__ = ('buf', 'start', 'checksum')
+
+    def __init__(self, header, fixed, nvar=0):
+        assert len(header) == 3
+        head = bytes(header) + bytes((len(fixed) + nvar,)) + bytes(fixed)
+        self.buf = bytearray(head) + bytearray(nvar + 1)
+        self.start = len(head)
+        ck = 0x0
+        for c in head:
+            ck ^= c
+        self.checksum = ck
+
+    def build(self, *values):
+        buf = self.buf
+        ck = self.checksum
+        i = self.start
+        for v in values:
+            buf[i] = v
+            ck ^= v
+            i += 1
+        assert i == len(buf) - 1
+        buf[i] = ck
+        # a copy, the frame may still be waiting for TX when the
+        # template is used again
+        return bytes(buf)
+
+
+class WorkItem():
+    __slots__ = ('priority', 'key', 'kind', 'data', 'time', 'deadline', 'live')
+
+    def __init__(self, priority, key, kind, data, now, deadline):
+        self.priority = priority
+        self.key = key
+        self.kind = kind
+        self.data = data
+        self.time = now
+        self.deadline = deadline
+        self.live = True
+
+
+class WorkQueue():
+    """
+    Pending bus work in priority classes, first in first out within
+    a class. An item whose key is already waiting either supersedes
+    the waiting one, which is dropped, or is dropped itself. Items past
+    their deadline are dropped when they come up. Removed items stay
+    in their deque marked dead, so every operation is O(1).
+    """
+
+    def __init__(self):
+        self.classes = tuple(deque() for _ in PRIORITIES)
+        self.keys = {}
+        self.depth = [0] * len(PRIORITIES)
+        self.wait = tuple(Histogram() for _ in PRIORITIES)
+        self.expired = [0] * len(PRIORITIES)
+        self.merged = [0] * len(PRIORITIES)
+
+    def __len__(self):
+        return sum(self.depth)
+
+    def get(self, key):
+        return self.keys.get(key)
+
+    def put(self, priority, key, kind, data, ttl=None, supersede=True):
+        """Queue an item, False if an item of key was kept instead."""
+        now = time.monotonic()
+        old = self.keys.get(key)
+        if old is not None:
+            if not supersede and old.priority <= priority:
+                self.merged[priority] += 1
+                return False
+            self.discard(old)
+            self.merged[old.priority] += 1
+        item = WorkItem(
+            priority, key, kind, data, now,
+            None if ttl is None else now + ttl
+        )
+        self.classes[priority].append(item)
+        self.keys[key] = item
+        self.depth[priority] += 1
+        return True
+
+    def discard(self, item):
+        item.live = False
+        del self.keys[item.key]
+        self.depth[item.priority] -= 1
+
+    def pop(self, now, kind=None):
+        """
+        The next live item, None if there is none or, when kind is
+        given, the next one is of another kind.
+        """
+        for priority, items in enumerate(self.classes):
+            while items:
+                item = items[0]
+                if not item.live:
+                    items.popleft()
+                    continue
+                if item.deadline is not None and now > item.deadline:
+                    items.popleft()
+                    self.discard(item)
+                    self.expired[priority] += 1
+                    logger.warning(
+                        'dropped %s %s after %.1f s in the queue',
+                        PRIORITIES[priority], item.key, now - item.time
+                    )
+                    continue
+                if kind is not None and item.kind != kind:
+                    return None
+                items.popleft()
+                self.discard(item)
+                self.wait[priority].observe(now - item.time)
+                return item
+        return None
+
+    def clear(self):
+        for items in self.classes:
+            items.clear()
+        self.keys.clear()
+        self.depth = [0] * len(PRIORITIES)
+
+
+class PollItem():
+    __slots__ = ('qid', 'min', 'max', 'interval', 'due', 'value')
+
+    def __init__(self, qid, min_interval, max_interval):
+        self.qid = qid
+        self.min = min_interval
+        self.max = max_interval
+        self.interval = min(max(QUERY_INTERVAL, min_interval), max_interval)
+        self.due = 0.0
+        self.value = None
+
+
+class PollSchedule():
+    """
+    Polling schedule with an own interval per query id.
+    The interval is halved when a polled value changed and grows by
+    BACKOFF while it stays the same, within the bounds of the item.
+    """
+
+    def __init__(self, schedule):
+        self.items = {
+            qid: PollItem(qid, *bounds) for qid, bounds in schedule.items()
+        }
+
+    def next_due(self):
+        return min((item.due for item in self.items.values()), default=None)
+
+    def due(self, now):
+        qids = []
+        for item in self.items.values():
+            if item.due <= now:
+                item.due = now + item.interval
+                qids.append(item.qid)
+        return qids
+
+    def result(self, qid, value, now):
+        """Reschedule qid, True when value differs from the last one."""
+        item = self.items.get(qid)
+        if item is None:
+            return False
+        changed = value != item.value
+        if changed and item.value is not None:
+            item.interval = max(item.interval / 2, item.min)
+        else:
+            item.interval = min(item.interval * BACKOFF, item.max)
+        item.value = value
+        item.due = now + item.interval
+        return changed
+
+    def snapshot(self):
+        """{qid: [due, interval]}, due in wall clock seconds."""
+        return {
+            qid: [item.due, item.interval] for qid, item in self.items.items()
+        }
+
+    def restore(self, data, values):
+        for qid, (due, interval) in data.items():
+            item = self.items.get(qid)
+            if item is None:
+                continue
+            item.due = due
+            item.interval = min(max(interval, item.min), item.max)
+            item.value = values.get(qid)
+
+
 class Aircon():
 
     MAX_TMP = 29
     MIN_TMP = 18
 
-    def __init__(self, addr):
+    def __init__(
+            self, addr, query_window=QUERY_WINDOW, schedule=None, unit=0x00,
+            heartbeat=STATUS_HEARTBEAT):
         self.transmit = None
         self.start_cb = None
         self.ready_cb = None
         self.state_cb = None
         self.update_cb = None
         self.status_cb = None
+        self.wakeup_cb = None
         self.update = False
-        self.queue = []
-        self.tx_waiting_packet = None
+        self.work = WorkQueue()
+        self.outstanding = deque()
+        self.replies = []
+        self.query_window = max(query_window, 1)
+        self.schedule = PollSchedule(
+            QUERY_SCHEDULE if schedule is None else schedule
+        )
+        self.tx_waiting = []
         self.tx_packet = None
-        self.cmd_setting = None
+        self.cmd_settings = ()
         self.machine = StateMachine(self)
         self.addr = addr
+        self.unit = unit
+        self.decoders = self.build_decoders()
+        self.templates = self.build_templates()
+        self.query_frames = {}
+        for qid in self.schedule.items:
+            self.query_frame(qid)
+        self.unknown_frames = 0
+        self.parse_errors = 0
+        self.rx_frames = [0] * 256  # by opcode
+        self.tx_frames = 0
+        self.query_sent = 0.0
+        self.query_rtt = Histogram()
+        self.cmd_time = 0.0
+        self.cmd_latency = Histogram()
+        self.heartbeat = heartbeat
+        self.status_time = 0.0
+        self.status_emitted = 0
+        self.status_suppressed = 0
 
         self.state1 = None
         self.state2 = None
+        self.frame1 = None  # last decoded status broadcasts
+        self.frame2 = None
         self.params = None
         self.power = None
         self.mode = None
@@ -335,208 +673,338 @@ class Aircon():
 
     @property
     def state(self):
-        # pylint: disable=no-member
         return self.machine.state
 
-    def loop(self):
-        with lock:
-            if self.tx_waiting_packet is not None:
-                self.transmit(self.tx_waiting_packet)
-                self.tx_waiting_packet = None
+    def wakeup(self):
+        if callable(self.wakeup_cb):
+            # pylint: disable=not-callable
+            self.wakeup_cb()
+
+    def next_timeout(self):
+        """
+        Seconds until loop() has work that is not triggered by
+        a received packet or a state change, None if there is none.
+        """
+        deadline = self.machine.deadline
+        if deadline is not None:
+            return max(deadline - time.monotonic(), 0.0)
+        if self.state != State.IDLE:
+            return None
+        if self.work or self.update:
+            return 0.0
+        due = self.schedule.next_due()
+        if due is None:
+            return None
+        return max(due - time.time(), 0.0)
 
+    def loop(self):
+        self.machine.check_timeout(time.monotonic())
         if self.state == State.IDLE:
-            if self.queue:
-                func, kwargs = self.queue.pop(0)
-                try:
-                    func(**kwargs)
-                except Exception as e:
-                    logger.error('executing queue failed: %s', e)
+            item = self.work.pop(time.monotonic()) if self.work else None
+            if item is not None:
+                if item.kind == 'cmd':
+                    self.cmd_time = time.monotonic()
+                    func, kwargs = item.data
+                    try:
+                        func(**kwargs)
+                    except Exception as e:
+                        logger.error('executing queue failed: %s', e)
+                else:
+                    self.send_queries(item)
             elif self.update:
                 if callable(self.update_cb):
                     # pylint: disable=not-callable
                     self.update_cb()
                 self.update = False
-            elif time.time() - self.q_time > QUERY_INTERVAL:
-                self.power_query()
-                self.filter_query()
-                self.sensor_query(0x02)
-                self.sensor_query(0x03)
-                self.sensor_query(0x04)
-                self.sensor_query(0x60)
-                self.sensor_query(0x61)
-                self.sensor_query(0x62)
-                self.sensor_query(0x63)
-                self.sensor_query(0x65)
-                self.sensor_query(0x6a)
-                self.q_time = time.time()
-                self.update = True
-        elif self.state == State.WSTAT:
-            var = self.cmd_setting.var
-            value = getattr(self, var)
-            if (var == 'mode'
-                    and self.bits_to_text('mode', value).startswith('auto')):
-                value = self.cmd_to_bits('mode', 'A')
-            if value == self.cmd_setting.value:
-                # pylint: disable=no-member
-                self.machine.idle()
-                self.cmd_setting = None
-        elif self.state == State.SSAVE:
-            p0 = self.tx_packet
-            if (p0[7] >> 4) & 0b11 == self.save:
-                # pylint: disable=no-member
-                self.machine.idle()
-        elif self.state == State.FILTER:
-            if self.filter == 0:
-                # pylint: disable=no-member
-                self.machine.idle()
-        elif self.state == State.HUMID:
-            if self.humid == self.machine.hmd:
-                # pylint: disable=no-member
-                self.machine.idle()
+            else:
+                now = time.time()
+                qids = self.schedule.due(now)
+                for qid in qids:
+                    if qid in EXTRA_QUERIES:
+                        self.extra_query(qid)
+                    else:
+                        self.sensor_query(qid)
+                if qids:
+                    self.q_time = now
+
+        with lock:
+            tx_waiting = self.tx_waiting
+            self.tx_waiting = []
+        for p in tx_waiting:
+            self.transmit(p)
+
+    def confirm(self):
+        """
+        Called for every decoded status broadcast and on entering a
+        state of CONFIRMS, returns to idle once the status shows the
+        result of the command.
+        """
+        name = CONFIRMS.get(self.state)
+        if name is None or not getattr(self, name)():
+            return
+        if self.state == State.WSTAT:
+            self.cmd_latency.observe(time.monotonic() - self.cmd_time)
+            self.cmd_settings = ()
+        self.machine.idle()
+
+    def wstat_confirmed(self):
+        return all(self.confirmed(s) for s in self.cmd_settings)
+
+    def ssave_confirmed(self):
+        return (self.tx_packet[7] >> 4) & 0b11 == self.save
+
+    def filter_confirmed(self):
+        return self.filter == 0
+
+    def humid_confirmed(self):
+        return self.humid == self.machine.hmd
+
+    def confirmed(self, setting):
+        value = getattr(self, setting.var)
+        if (setting.var == 'mode'
+                and self.bits_to_text('mode', value).startswith('auto')):
+            value = self.cmd_to_bits('mode', 'A')
+        return value == setting.value
 
     def _transmit(self, p):
+        self.tx_frames += 1
         with lock:
-            self.tx_waiting_packet = p
+            self.tx_waiting.append(p)
+        self.wakeup()
+
+    def build_decoders(self):
+        """
+        Compile the (destination, opcode, subcode) decoder map into
+        a table indexed by p[1] and p[2]. Subcode is p[4] << 8 | p[5],
+        only used for replies addressed to us.
+        """
+        decoders = {
+            (0xfe, 0x58, None): self.parse_state1,
+            (0xfe, 0x1c, None): self.parse_state2,
+            (0x52, 0x11, None): self.parse_params,
+            (self.addr, 0x18, 0x80a1): self.parse_ack,
+            (self.addr, 0x1a, 0x80ef): self.parse_sensor,
+            (self.addr, 0x18, 0x80e8): self.parse_extra,
+        }
+        table = [None] * 256
+        for (dst, opcode, subcode), decoder in decoders.items():
+            if table[dst] is None:
+                table[dst] = [None] * 256
+            row = table[dst]
+            if subcode is None:
+                row[opcode] = decoder
+            else:
+                if row[opcode] is None:
+                    row[opcode] = {}
+                row[opcode][subcode] = decoder
+        return table
 
     def parse(self, p):
-        if p[0] == 0x00:
-            if p[1] == 0xfe:
-                self.parse_broadcast(p)
-            elif p[1] == 0x52:
-                self.parse_params(p)
-            elif p[1] == self.addr:
-                self.parse_reply(p)
-
-    def parse_broadcast(self, p):
-        if p[2] == 0x58:
-            payload = p[6:14]
-            self.state1 = payload
-            self.temp2 = (payload[5] >> 1) - 35
-            self.save1 = payload[7] & 0b1
-            if self.state == State.START:
-                # pylint: disable=no-member
-                self.machine.idle()
-            ext = True
-        elif p[2] == 0x1c:
-            payload = p[6:12]
-            self.state2 = payload
-            ext = False
-        if p[2] == 0x58 or p[2] == 0x1c:
-            self.power = payload[0] & 0b1
-            self.mode = (payload[0] >> 5) & 0b111
-            self.save = (payload[0] >> 3) & 0b11
-            self.clean = (payload[1] >> 2) & 0b1
-            self.fan_lv = (payload[1] >> 5) & 0b111
-            self.filter = (payload[2] >> 7) & 0b1
-            self.vent = (payload[2] >> 2) & 0b1
-            self.humid = (payload[2] >> 1) & 0b1
-            self.temp1 = (payload[4] >> 1) - 35
-            if callable(self.status_cb):
-                # pylint: disable=not-callable
-                self.status_cb(ext)
+        if len(p) < 6:
+            self.parse_errors += 1
+            return
+        self.rx_frames[p[2]] += 1
+        if p[0] == self.unit:
+            row = self.decoders[p[1]]
+            if row is not None:
+                decoder = row[p[2]]
+                if type(decoder) is dict:
+                    decoder = decoder.get(p[4] << 8 | p[5])
+                if decoder is not None:
+                    try:
+                        decoder(p)
+                    except Exception as e:
+                        self.parse_errors += 1
+                        logger.error('parse %s failed: %s', bytes(p).hex(), e)
+                    return
+        self.unknown_frames += 1
+
+    def parse_state1(self, p):
+        if self.machine.state == START:
+            self.machine.idle()
+        if not self.status_changed(self.frame1, p):
+            return
+        self.frame1 = p
+        self.state1 = p[6:14]
+        self.temp2 = TEMPERATURE[p[11]]
+        self.save1 = p[13] & 0b1
+        self.parse_broadcast(p, True)
+
+    def parse_state2(self, p):
+        if not self.status_changed(self.frame2, p):
+            return
+        self.frame2 = p
+        self.state2 = p[6:12]
+        self.parse_broadcast(p, False)
+
+    def status_changed(self, previous, p):
+        """
+        The unit repeats its status broadcasts, only frames whose bytes
+        differ from the previous one of the same type, or the first one
+        after the heartbeat interval, are decoded and published. Whole
+        frames are compared, a repeat is dropped without copying it.
+        """
+        if p == previous and (
+                not self.heartbeat
+                or time.monotonic() - self.status_time < self.heartbeat):
+            self.status_suppressed += 1
+            return False
+        self.status_time = time.monotonic()
+        self.status_emitted += 1
+        return True
+
+    def parse_broadcast(self, p, ext):
+        self.decode_broadcast(p)
+        if callable(self.status_cb):
+            # pylint: disable=not-callable
+            self.status_cb(ext)
+        if self.machine.state in CONFIRMS:
+            self.confirm()
+
+    def decode_broadcast(self, p):
+        # fields common to the 0x58 and 0x1c status frames
+        self.power, self.mode, self.save = STATUS_B0[p[6]]
+        self.clean, self.fan_lv = STATUS_B1[p[7]]
+        self.filter, self.vent, self.humid = STATUS_B2[p[8]]
+        self.temp1 = TEMPERATURE[p[10]]
 
     def parse_params(self, p):
-        if p[2] == 0x11:
+        params = self.params
+        if params is None or params[0] != p[6] or params[1] != p[7]:
             self.params = p[6:8]
 
-    def parse_reply(self, p):
-        if p[2] == 0x18 and p[4] == 0x80 and p[5] == 0xa1:
-            if self.state == State.CMD:
-                # pylint: disable=no-member
-                self.machine.wstat()
-            elif self.state == State.HMDTGL:
-                # pylint: disable=no-member
-                self.machine.humid()
-        if p[2] == 0x1a and p[4] == 0x80 and p[5] == 0xef:
-            if self.state == State.QUERY1:
-                p0 = self.tx_packet
-                if p[8] == 0x2c:
-                    self.sensor[p0[11]] = (
-                        struct.unpack('>h', bytes(p[9:11]))[0]
-                    )
-                else:
-                    self.sensor[p0[11]] = None
-                # pylint: disable=no-member
-                self.machine.idle()
-        if p[2] == 0x18 and p[4] == 0x80 and p[5] == 0xe8:
-            if self.state == State.QUERY2:
-                p0 = self.tx_packet
-                self.extra[p0[9]] = p[6:11]
-                if p0[9] == 0x94:
-                    self.pwr_lv1 = p[9]
-                    self.pwr_lv2 = p[10]
-                elif p0[9] == 0x9e:
-                    self.filter_time = (p[9] << 8) + p[10]
-                # pylint: disable=no-member
-                self.machine.idle()
+    def parse_ack(self, _p):
+        state = self.machine.state
+        if state == CMD:
+            self.machine.wstat()
+        elif state == HMDTGL:
+            self.machine.humid()
+
+    def parse_sensor(self, p):
+        if self.machine.state == QUERY1 and self.outstanding:
+            self.add_reply(sensor_value(p))
+
+    def parse_extra(self, p):
+        if self.machine.state == QUERY2 and self.outstanding:
+            self.add_reply(extra_value(p))
+
+    def add_reply(self, value):
+        """
+        Collect the replies to the outstanding queries. They do not
+        carry the query id, so they are only assigned once the whole
+        batch is answered, in send order. A batch with a lost reply
+        times out and is sent again, see _send_queries.
+        """
+        self.query_rtt.observe(time.monotonic() - self.query_sent)
+        self.replies.append(value)
+        if len(self.replies) < len(self.outstanding):
+            return
+        now = time.time()
+        for qid, value in zip(self.outstanding, self.replies):
+            self.store_reply(qid, value, now)
+        self.outstanding.clear()
+        self.replies.clear()
+        self.machine.idle()
+
+    def store_reply(self, qid, value, now):
+        """Keep the reply value of query qid received at epoch now."""
+        if qid in EXTRA_QUERIES:
+            self.extra[qid] = value
+            if qid == 0x94:
+                self.pwr_lv1 = value[3]
+                self.pwr_lv2 = value[4]
+            elif qid == 0x9e:
+                self.filter_time = EXTRA_VALUE.unpack_from(value, 3)[0]
+        else:
+            self.sensor[qid] = value
+        # the update goes out once the queued queries are answered,
+        # only when one of them brought a new value
+        if self.schedule.result(qid, value, now):
+            self.update = True
 
     def bits_to_text(self, cmdtype, bits):
-        text = f'{bits:b}'
-        for csi in getattr(CMDSETS, cmdtype):
-            if csi.bits == bits:
-                text = csi.text
-                break
-        return text
+        table = BITS_TEXT[cmdtype]
+        if 0 <= bits < len(table):
+            return table[bits]
+        return f'{bits:b}'
 
     def cmd_to_bits(self, cmdtype, cmd):
         if cmd == '':
             raise ValueError(
                 f'empty command: type: {cmdtype}'
             )
-        bits = None
-        for csi in getattr(CMDSETS, cmdtype):
-            if csi.cmd == cmd:
-                bits = csi.bits
-                break
+        bits = CMD_BITS[cmdtype].get(cmd)
         if bits is None:
             raise ValueError(
                 f'invalid command: type: {cmdtype}, value: {cmd}'
             )
         return bits
 
-    def gen_pkt(self, header, payload):
-        assert len(header) == 3
-        p = []
-        p += header
-        p.append(len(payload))
-        p += payload
-        ck = 0x0
-        for c in p:
-            ck ^= c
-        p.append(ck)
+    def build_templates(self):
+        addr = self.addr
+        unit = self.unit
+        return {
+            'power': PacketTemplate([addr, unit, 0x11], [0x08, 0x41], 1),
+            'mode': PacketTemplate([addr, unit, 0x11], [0x08, 0x42], 1),
+            'cmd': PacketTemplate([addr, unit, 0x11], [0x08, 0x4c], 3),
+            'sensor': PacketTemplate(
+                [addr, unit, 0x17],
+                [0x08, 0x80, 0xef, 0x00, 0x2c, 0x08, 0x00], 1
+            ),
+            'extra': PacketTemplate(
+                [addr, unit, 0x15], [0x08, 0xe8, 0x00, 0x01, 0x00], 1
+            ),
+            'save': PacketTemplate([addr, 0xfe, 0x10], [0x00, 0x4c], 3),
+            'filter': PacketTemplate([addr, 0xfe, 0x10], [0x00, 0x4b]),
+            'humid': PacketTemplate([addr, unit, 0x11], [0x08, 0x52, 0x01]),
+        }
+
+    def gen_pkt(self, template, *values):
+        p = self.templates[template].build(*values)
         self.tx_packet = p
         return p
 
+    def query_frame(self, qid):
+        """Sensor or extra query frame of qid, built once."""
+        p = self.query_frames.get(qid)
+        if p is None:
+            if qid in EXTRA_QUERIES:
+                p = self.templates['extra'].build(qid)
+            else:
+                p = self.templates['sensor'].build(qid)
+            self.query_frames[qid] = p
+        return p
+
+    def enqueue(self, key, func, kwargs):
+        """
+        Queue a control command. A waiting command of the same key is
+        superseded, it is dropped and the new one goes to the end.
+        """
+        self.work.put(
+            CONTROL, key, 'cmd', (func, kwargs), ttl=COMMAND_TTL
+        )
+
     def set_power(self, cmd):
         logger.info('set_power: %s', cmd)
         kwargs = {'callback': (self._set_power, (cmd,))}
-        # pylint: disable=no-member
-        self.queue.append((self.machine.cmd, kwargs))
+        self.enqueue('power', self.machine.cmd, kwargs)
 
     def _set_power(self, cmd):
         value = self.cmd_to_bits('power', cmd)
-        self.cmd_setting = CmdSetting('power', value)
-        header = [self.addr, 0x00, 0x11]
-        payload = [0x08, 0x41]
-        byte = 0x02 | value
-        payload.append(byte)
-        p = self.gen_pkt(header, payload)
+        self.cmd_settings = (CmdSetting('power', value),)
+        p = self.gen_pkt('power', 0x02 | value)
         # pylint: disable=not-callable
         self._transmit(p)
 
     def set_mode(self, cmd):
         logger.info('set_mode: %s', cmd)
         kwargs = {'callback': (self._set_mode, (cmd,))}
-        # pylint: disable=no-member
-        self.queue.append((self.machine.cmd, kwargs))
+        self.enqueue('mode', self.machine.cmd, kwargs)
 
     def _set_mode(self, cmd):
         value = self.cmd_to_bits('mode', cmd)
-        self.cmd_setting = CmdSetting('mode', value)
-        header = [self.addr, 0x00, 0x11]
-        payload = [0x08, 0x42]
-        payload.append(value)
-        p = self.gen_pkt(header, payload)
+        self.cmd_settings = (CmdSetting('mode', value),)
+        p = self.gen_pkt('mode', value)
         # pylint: disable=not-callable
         self._transmit(p)
 
@@ -545,121 +1013,172 @@ class Aircon():
         assert fan_lv is not None
         assert temp >= self.MIN_TMP
         assert temp <= self.MAX_TMP
-        header = [self.addr, 0x00, 0x11]
-        payload = [0x08, 0x4c]
-        mode = mode & 0b111
-        byte = head << 3 | mode
-        payload.append(byte)
-        fan_lv = fan_lv & 0b111
-        byte = 0b111000 | fan_lv
-        payload.append(byte)
-        temp = (temp + 35) << 1
-        payload.append(temp)
-        p = self.gen_pkt(header, payload)
+        p = self.gen_pkt(
+            'cmd', head << 3 | mode & 0b111, 0b111000 | fan_lv & 0b111,
+            (temp + 35) << 1
+        )
         # pylint: disable=not-callable
         self._transmit(p)
 
     def set_temp(self, temp):
         logger.info('set_temp: %s', temp)
-        kwargs = {'callback': (self._set_temp, (temp,))}
-        # pylint: disable=no-member
-        self.queue.append((self.machine.cmd, kwargs))
+        self.queue_cmd(temp=temp)
 
-    def _set_temp(self, temp):
-        assert self.state != State.START
+    def set_fan(self, cmd):
+        logger.info('set_fan: %s', cmd)
+        self.queue_cmd(fan=cmd)
+
+    def check_temp(self, temp):
         if not isinstance(temp, int):
             raise TypeError('temp is not integer')
         if temp < self.MIN_TMP or temp > self.MAX_TMP:
             raise ValueError('invalid temp value')
-        self.cmd_setting = CmdSetting('temp1', temp)
-        modes = ['heat', 'dry', 'cool', 'auto heat', 'auto cool']
-        if self.bits_to_text('mode', self.mode) not in modes:
-            raise ValueError('set temp in invalid mode')
-        self.set_cmd(0b01, self.mode, self.fan_lv, temp)
 
-    def set_fan(self, cmd):
-        logger.info('set_fan: %s', cmd)
-        kwargs = {'callback': (self._set_fan, (cmd,))}
-        # pylint: disable=no-member
-        self.queue.append((self.machine.cmd, kwargs))
-
-    def _set_fan(self, cmd):
+    def queue_cmd(self, **settings):
+        """
+        Fan level and temperature share the 0x4c frame, a change of
+        one of them is merged with the waiting changes of the other.
+        Each setting is checked here, an invalid one is rejected alone
+        and does not take the waiting change of the other with it.
+        """
+        try:
+            if 'fan' in settings:
+                self.cmd_to_bits('fan', settings['fan'])
+            if 'temp' in settings:
+                self.check_temp(settings['temp'])
+        except (TypeError, ValueError) as e:
+            logger.error('queue_cmd: %s', e)
+            return
+        item = self.work.get('cmd')
+        if item is not None:
+            _func, kwargs = item.data
+            settings = dict(kwargs['callback'][1][0], **settings)
+        kwargs = {'callback': (self._set_cmd, (settings,))}
+        self.enqueue('cmd', self.machine.cmd, kwargs)
+
+    def _set_cmd(self, settings):
         assert self.state != State.START
-        value = self.cmd_to_bits('fan', cmd)
-        self.cmd_setting = CmdSetting('fan_lv', value)
-        self.set_cmd(0b10, self.mode, value, self.temp1)
+        head = 0
+        fan_lv = self.fan_lv
+        temp = self.temp1
+        expected = []
+        if 'fan' in settings:
+            head |= 0b10
+            fan_lv = self.cmd_to_bits('fan', settings['fan'])
+            expected.append(CmdSetting('fan_lv', fan_lv))
+        if 'temp' in settings:
+            # the mode may have changed since the temp was queued
+            modes = ['heat', 'dry', 'cool', 'auto heat', 'auto cool']
+            if self.bits_to_text('mode', self.mode) in modes:
+                head |= 0b01
+                temp = settings['temp']
+                expected.append(CmdSetting('temp1', temp))
+            elif head:
+                logger.error('set temp in invalid mode, fan level only')
+            else:
+                raise ValueError('set temp in invalid mode')
+        self.cmd_settings = tuple(expected)
+        self.set_cmd(head, self.mode, fan_lv, temp)
+
+    def send_queries(self, item):
+        """
+        Send item and up to query_window - 1 following queued queries
+        of the same kind back to back, see add_reply for how the
+        replies are matched.
+        """
+        kind = item.kind
+        self.outstanding.clear()
+        now = time.monotonic()
+        while item is not None:
+            self.outstanding.append(item.data)
+            if len(self.outstanding) >= self.query_window:
+                break
+            item = self.work.pop(now, kind)
+        kwargs = {'callback': (self._send_queries, (kind,))}
+        if kind == 'sensor':
+            self.machine.query1(**kwargs)
+        else:
+            self.machine.query2(**kwargs)
+
+    def _send_queries(self, kind):
+        # also used for retries, the replies of a partly answered batch
+        # cannot be told apart, so the whole batch is sent again
+        self.replies.clear()
+        self.query_sent = time.monotonic()
+        for qid in self.outstanding:
+            if kind == 'sensor':
+                self._sensor_query(qid)
+            else:
+                self._extra_query(qid)
+
+    def queue_query(self, kind, qid, priority=QUERY):
+        """
+        Queue a query unless the same one is already waiting. A
+        periodic query is stale after the minimum interval of its item.
+        """
+        item = self.schedule.items.get(qid)
+        if priority == QUERY and item is not None:
+            ttl = item.min
+        else:
+            ttl = COMMAND_TTL
+        return self.work.put(
+            priority, (kind, qid), kind, qid, ttl=ttl, supersede=False
+        )
 
     def sensor_query(self, qid):
         logger.debug('sendor_query: %s', qid)
-        self.sensor[qid] = 0
-        kwargs = {'callback': (self._sensor_query, (qid,))}
-        # pylint: disable=no-member
-        self.queue.append((self.machine.query1, kwargs))
+        if self.queue_query('sensor', qid):
+            self.sensor[qid] = 0
 
     def _sensor_query(self, qid):
         assert qid < 0xff
-        header = [self.addr, 0x00, 0x17]
-        payload = [0x08, 0x80]
-        payload += [0xef, 0x00, 0x2c, 0x08, 0x00]
-        payload.append(qid)
-        p = self.gen_pkt(header, payload)
+        p = self.query_frame(qid)
+        self.tx_packet = p
         # pylint: disable=not-callable
         self._transmit(p)
 
-    def extra_query(self, qid):
+    def extra_query(self, qid, priority=QUERY):
         logger.debug('extra_query: %s', qid)
-        self.extra[qid] = 0
-        kwargs = {'callback': (self._extra_query, (qid,))}
-        # pylint: disable=no-member
-        self.queue.append((self.machine.query2, kwargs))
+        if self.queue_query('extra', qid, priority):
+            self.extra[qid] = 0
 
     def _extra_query(self, qid):
-        assert qid in [0x94, 0x9e]
-        header = [self.addr, 0x00, 0x15]
-        payload = [0x08, 0xe8]
-        payload += [0x00, 0x01, 0x00]
-        payload.append(qid)
-        p = self.gen_pkt(header, payload)
+        assert qid in EXTRA_QUERIES
+        p = self.query_frame(qid)
+        self.tx_packet = p
         # pylint: disable=not-callable
         self._transmit(p)
 
+    # on demand reads, ahead of the periodic queries
+
     def power_query(self):
-        self.extra_query(0x94)
+        self.extra_query(0x94, CONFIRM)
 
     def filter_query(self):
-        self.extra_query(0x9e)
+        self.extra_query(0x9e, CONFIRM)
 
     def set_save(self, cmd):
         logger.info('set_save: %s', cmd)
         kwargs = {'callback': (self._set_save, (cmd,))}
-        # pylint: disable=no-member
-        self.queue.append((self.machine.ssave, kwargs))
+        self.enqueue('save', self.machine.ssave, kwargs)
 
     def _set_save(self, cmd):
         assert self.state != State.START
         bits = self.cmd_to_bits('save', cmd)
-        header = [self.addr, 0xfe, 0x10]
-        payload = [0x00, 0x4c]
-        a = 0b100000 | self.mode
-        payload.append(a)
-        a = bits << 4 | 0b1000 | self.fan_lv
-        payload.append(a)
-        a = (self.temp1 + 35) << 1
-        payload.append(a)
-        p = self.gen_pkt(header, payload)
+        p = self.gen_pkt(
+            'save', 0b100000 | self.mode, bits << 4 | 0b1000 | self.fan_lv,
+            (self.temp1 + 35) << 1
+        )
         # pylint: disable=not-callable
         self._transmit(p)
 
     def reset_filter(self):
         logger.info('reset_filter')
         kwargs = {'callback': (self._reset_filter, ())}
-        # pylint: disable=no-member
-        self.queue.append((self.machine.filter, kwargs))
+        self.enqueue('filter', self.machine.filter, kwargs)
 
     def _reset_filter(self):
-        header = [self.addr, 0xfe, 0x10]
-        payload = [0x00, 0x4b]
-        p = self.gen_pkt(header, payload)
+        p = self.gen_pkt('filter')
         # pylint: disable=not-callable
         self._transmit(p)
 
@@ -667,37 +1186,91 @@ class Aircon():
         logger.info('toggle_humid')
         modes = ['heat', 'auto heat']
         if self.bits_to_text('mode', self.mode) not in modes:
-            # pylint: disable=no-member
             self.machine.idle()
             return
         if self.bits_to_text('power', self.power) == 'off':
-            # pylint: disable=no-member
             self.machine.idle()
             return
         kwargs = {'callback': (self._toggle_humid, ())}
-        # pylint: disable=no-member
         self.machine.hmdtgl(**kwargs)
 
     def _toggle_humid(self):
-        header = [self.addr, 0x00, 0x11]
-        payload = [0x08, 0x52, 0x01]
-        p = self.gen_pkt(header, payload)
+        p = self.gen_pkt('humid')
         # pylint: disable=not-callable
         self._transmit(p)
 
     def set_humid(self, cmd):
         logger.info('set_humid: %s', cmd)
         kwargs = {'cmd': cmd}
-        self.queue.append((self._set_humid, kwargs))
+        self.enqueue('humid', self._set_humid, kwargs)
 
     def _set_humid(self, cmd):
         assert self.state != State.START
         value = self.cmd_to_bits('humid', cmd)
-        # pylint: disable=no-member
         self.machine.humid(value=value)
 
+    def snapshot(self):
+        """
+        Last decoded state and polling schedule as JSON-serializable
+        data, bytes as hex and query ids as hex keys.
+        """
+        def hexkeys(data):
+            return {f'{qid:02x}': value for qid, value in data.items()}
+
+        return {
+            'state1': self.state1.hex() if self.state1 else None,
+            'state2': self.state2.hex() if self.state2 else None,
+            'pwr_lv1': self.pwr_lv1,
+            'pwr_lv2': self.pwr_lv2,
+            'filter_time': self.filter_time,
+            'q_time': self.q_time,
+            'sensor': hexkeys(self.sensor),
+            'extra': hexkeys({
+                qid: bytes(v).hex() for qid, v in self.extra.items()
+                if isinstance(v, (bytes, bytearray))
+            }),
+            'schedule': hexkeys(self.schedule.snapshot()),
+        }
+
+    def restore(self, data):
+        """
+        Load a snapshot() of an earlier run. The status fields are
+        decoded from the stored broadcasts, state1 and state2 stay None
+        so the first live broadcast is published in any case.
+        """
+        def intkeys(values):
+            return {int(qid, 16): value for qid, value in values.items()}
+
+        for key in ('state2', 'state1'):
+            if data.get(key):
+                p = bytes(6) + bytes.fromhex(data[key])
+                self.decode_broadcast(p)
+                if key == 'state1':
+                    self.temp2 = TEMPERATURE[p[11]]
+                    self.save1 = p[13] & 0b1
+        self.pwr_lv1 = data.get('pwr_lv1', 0)
+        self.pwr_lv2 = data.get('pwr_lv2', 0)
+        self.filter_time = data.get('filter_time', 0)
+        self.q_time = data.get('q_time', 0.0)
+        self.sensor = intkeys(data.get('sensor', {}))
+        self.extra = {
+            qid: bytes.fromhex(v)
+            for qid, v in intkeys(data.get('extra', {})).items()
+        }
+        self.schedule.restore(
+            intkeys(data.get('schedule', {})),
+            {**self.sensor, **self.extra}
+        )
+
     def reset(self):
-        self.queue = []
+        self.work.clear()
+        self.outstanding.clear()
+        self.replies.clear()
         self.machine.reset()
         self.tx_packet = None
-        self.cmd_setting = None
+        self.cmd_settings = ()
+        # publish the first status after a restart of the bridge
+        self.state1 = None
+        self.state2 = None
+        self.frame1 = None
+        self.frame2 = None